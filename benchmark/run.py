@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Measure the throughput of the synchronizations against the Shopware
+stand-in server (``stand_in.py``).
+
+For each size, a stand-in is started with generated data and a new
+Shopware backend is created, then the scenarios are run and the jobs
+they delay are executed in the same process.  It reports the records
+per second, the calls to the API, the SQL queries per record and the
+peak RSS, and writes them in a JSON file::
+
+    $ python benchmark/run.py -c odoo.cfg -d bench \\
+        --products 1000,10000,100000 --orders 1000,50000 \\
+        --output results.json --compare previous.json
+
+The synchronizations commit their work, so use a dedicated database
+where ``shopwareerpconnect`` is installed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import platform
+import resource
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import openerp
+from openerp import SUPERUSER_ID, api
+
+from stand_in import make_server
+
+_logger = logging.getLogger('shopware.benchmark')
+
+
+PRODUCT_SCENARIOS = [
+    'import_batch',
+    'bootstrap_catalog',
+    'bootstrap_parallel',
+    'import_record',
+    'export_product_inventory',
+    'recompute_shopware_qty',
+]
+ORDER_SCENARIOS = [
+    'sale_order_import_batch',
+]
+
+
+class Benchmark(object):
+    """ Run the scenarios for one size of data """
+
+    def __init__(self, env, server, backend_values=None, sample=1000):
+        self.env = env
+        self.server = server
+        self.sample = sample
+        self.session = self._session()
+        host, port = server.server_address[:2]
+        values = {
+            'name': 'Benchmark %s' % datetime.now().isoformat(),
+            'version': '5.2',
+            'location': 'http://%s:%d' % (host, port),
+            'username': 'benchmark',
+            'token': 'benchmark',
+            'warehouse_id': env.ref('stock.warehouse0').id,
+        }
+        values.update(backend_values or {})
+        self.backend = env['shopware.backend'].create(values)
+        self.session.commit()
+
+    def _session(self):
+        from openerp.addons.connector.session import ConnectorSession
+        return ConnectorSession.from_env(self.env)
+
+    def _count(self, model):
+        return self.env[model].search_count(
+            [('backend_id', '=', self.backend.id)])
+
+    def _api_calls(self):
+        return sum(count for resource, count in self.server.stats.items()
+                   if not resource.startswith('__'))
+
+    def _sql_queries(self):
+        return getattr(self.env.cr, 'sql_log_count', 0)
+
+    def run_jobs(self):
+        """ Execute the pending jobs until the queue is empty
+
+        Like in a worker, each job runs in its own transaction; the
+        jobs delayed by the jobs are executed as well.
+        """
+        from openerp.addons.connector.queue.job import OpenERPJobStorage
+        storage = OpenERPJobStorage(self.session)
+        job_model = self.env['queue.job']
+        done = failed = 0
+        while True:
+            pending = job_model.search([('state', '=', 'pending')],
+                                       order='priority, id')
+            if not pending:
+                break
+            for uuid in pending.mapped('uuid'):
+                job = storage.load(uuid)
+                try:
+                    job.perform(self.session)
+                except Exception as err:
+                    _logger.debug('job %s failed: %s', uuid, err)
+                    self.session.rollback()
+                    job.set_failed(exc_info=unicode(err))
+                    failed += 1
+                else:
+                    job.set_done()
+                    done += 1
+                storage.store(job)
+                self.session.commit()
+                self.env.invalidate_all()
+        return done, failed
+
+    def setup(self):
+        """ Import the shops and the categories, which are not measured """
+        from openerp.addons.shopwareerpconnect.unit.import_synchronizer \
+            import import_batch
+        import_batch(self.session, 'shopware.shop', self.backend.id)
+        import_batch(self.session, 'shopware.product.category',
+                     self.backend.id)
+        self.run_jobs()
+
+    def measure(self, scenario):
+        """ Run a scenario and return its measures """
+        calls = self._api_calls()
+        queries = self._sql_queries()
+        start = time.time()
+        records = getattr(self, 'scenario_%s' % scenario)()
+        done, failed = self.run_jobs()
+        elapsed = time.time() - start
+        calls = self._api_calls() - calls
+        queries = self._sql_queries() - queries
+        return OrderedDict([
+            ('scenario', scenario),
+            ('records', records),
+            ('seconds', round(elapsed, 3)),
+            ('records_per_sec', round(records / elapsed, 2)
+                if elapsed else None),
+            ('api_calls', calls),
+            ('api_calls_per_record', round(float(calls) / records, 2)
+                if records else None),
+            ('sql_queries', queries),
+            ('sql_queries_per_record', round(float(queries) / records, 2)
+                if records else None),
+            ('jobs_done', done),
+            ('jobs_failed', failed),
+            ('peak_rss_kb',
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+        ])
+
+    def scenario_import_batch(self):
+        from openerp.addons.shopwareerpconnect.unit.import_synchronizer \
+            import import_batch
+        before = self._count('shopware.product.product')
+        import_batch(self.session, 'shopware.article', self.backend.id)
+        self.run_jobs()
+        return self._count('shopware.product.product') - before
+
+    def scenario_bootstrap_catalog(self):
+        from openerp.addons.shopwareerpconnect.bootstrap import (
+            bootstrap_catalog)
+        # on a new backend, the products of this one are already imported
+        backend = self.backend.copy(
+            {'name': 'Bootstrap %s' % datetime.now().isoformat()})
+        self.session.commit()
+        bootstrap_catalog(self.session, backend.id)
+        return self.env['shopware.product.product'].search_count(
+            [('backend_id', '=', backend.id)])
+
+    def scenario_bootstrap_parallel(self):
+        from openerp.addons.shopwareerpconnect.parallel import (
+            import_parallel)
+        backend = self.backend.copy(
+            {'name': 'Parallel %s' % datetime.now().isoformat()})
+        self.session.commit()
+        import_parallel(self.env.cr.dbname, self.env.uid, backend.id)
+        return self.env['shopware.product.product'].search_count(
+            [('backend_id', '=', backend.id)])
+
+    def scenario_import_record(self):
+        from openerp.addons.shopwareerpconnect.unit.import_synchronizer \
+            import import_record
+        store = self.server.store
+        article_ids = list(store.resources['articles'])[:self.sample]
+        for article_id in article_ids:
+            import_record(self.session, 'shopware.article', self.backend.id,
+                          article_id, force=True)
+        return len(article_ids)
+
+    def scenario_export_product_inventory(self):
+        from openerp.addons.shopwareerpconnect.product import (
+            export_product_inventory)
+        bindings = self.env['shopware.product.product'].search(
+            [('backend_id', '=', self.backend.id)], limit=self.sample)
+        for binding_id in bindings.ids:
+            export_product_inventory(self.session,
+                                     'shopware.product.product',
+                                     binding_id, fields=['shopware_qty'])
+        return len(bindings)
+
+    def scenario_recompute_shopware_qty(self):
+        # force the export of all the quantities
+        self.env.cr.execute("UPDATE shopware_product_product "
+                            "SET shopware_qty = -1 WHERE backend_id = %s",
+                            (self.backend.id,))
+        self.env.invalidate_all()
+        self.backend.update_product_stock_qty()
+        return self._count('shopware.product.product')
+
+    def scenario_sale_order_import_batch(self):
+        from openerp.addons.shopwareerpconnect.sale import (
+            sale_order_import_batch)
+        before = self._count('shopware.sale.order')
+        for shop in self.backend.shop_ids:
+            sale_order_import_batch(self.session, 'shopware.sale.order',
+                                    self.backend.id,
+                                    {'shopware_shop_id': shop.shopware_id})
+        self.run_jobs()
+        return self._count('shopware.sale.order') - before
+
+
+def serve(**options):
+    """ Start a stand-in server in a thread on a free port """
+    server = make_server(port=0, **options)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """ Print the variation of the records per second and of the
+    queries per record with a previous run """
+    def key(result):
+        return (result['scenario'], result['size'])
+    former = dict((key(result), result) for result in previous['results'])
+    print('%-26s %8s %12s %12s' % ('scenario', 'size', 'records/s',
+                                   'queries/rec'))
+    for result in results:
+        old = former.get(key(result))
+        if not old:
+            continue
+        cells = []
+        for name in ('records_per_sec', 'sql_queries_per_record'):
+            if result[name] and old[name]:
+                cells.append('%+11.1f%%' % (
+                    (result[name] - old[name]) * 100. / old[name]))
+            else:
+                cells.append('%12s' % '-')
+        print('%-26s %8s %s %s' % (result['scenario'], result['size'],
+                                   cells[0], cells[1]))
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size]
+
+
+def parse_option(value):
+    name, __, option = value.partition('=')
+    return name, json.loads(option)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-c', '--config', help='Odoo configuration file')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--products', type=parse_sizes,
+                        default=[1000, 10000, 100000],
+                        help='comma-separated numbers of products')
+    parser.add_argument('--orders', type=parse_sizes, default=[1000, 50000],
+                        help='comma-separated numbers of sales orders')
+    parser.add_argument('--scenarios',
+                        type=lambda value: value.split(','),
+                        default=PRODUCT_SCENARIOS + ORDER_SCENARIOS)
+    parser.add_argument('--sample', type=int, default=1000,
+                        help='number of records of the scenarios working '
+                             'record by record')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each response of the '
+                             'stand-in')
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='requests per second answered by the '
+                             'stand-in, the next ones get a 429 response')
+    parser.add_argument('--backend-option', type=parse_option,
+                        action='append', default=[],
+                        metavar='FIELD=JSON',
+                        help='value of a field of the backend, '
+                             'e.g. import_chunk_size=50')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='results of a previous run')
+    args = parser.parse_args()
+
+    odoo_args = ['-d', args.database]
+    if args.config:
+        odoo_args += ['-c', args.config]
+    openerp.tools.config.parse_config(odoo_args)
+    openerp.netsvc.init_logger()
+
+    runs = [(size, dict(articles=size, customers=1, orders=0), scenario)
+            for size in args.products
+            for scenario in PRODUCT_SCENARIOS
+            if scenario in args.scenarios]
+    runs += [(size, dict(articles=100, customers=max(size // 2, 1),
+                         orders=size), scenario)
+             for size in args.orders
+             for scenario in ORDER_SCENARIOS
+             if scenario in args.scenarios]
+
+    results = []
+    registry = openerp.modules.registry.RegistryManager.get(args.database)
+    with api.Environment.manage():
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            benchmarks = {}
+            for size, data, scenario in runs:
+                key = (size, data['orders'])
+                if key not in benchmarks:
+                    # a new stand-in and backend per size, kept for the
+                    # following scenarios which need the imported data
+                    server = serve(latency=args.latency,
+                                   rate_limit=args.rate_limit, **data)
+                    benchmarks[key] = Benchmark(
+                        env, server, dict(args.backend_option),
+                        sample=args.sample)
+                    benchmarks[key].setup()
+                benchmark = benchmarks[key]
+                _logger.info('running %s with %d records', scenario, size)
+                result = benchmark.measure(scenario)
+                result['size'] = size
+                results.append(result)
+                print(json.dumps(result))
+            for benchmark in benchmarks.values():
+                benchmark.server.shutdown()
+
+    output = OrderedDict([
+        ('date', datetime.now().isoformat()),
+        ('revision', git_revision()),
+        ('python', platform.python_version()),
+        ('latency', args.latency),
+        ('rate_limit', args.rate_limit),
+        ('backend_options', dict(args.backend_option)),
+        ('results', results),
+    ])
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('results written in %s' % args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
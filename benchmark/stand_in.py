@@ -0,0 +1,657 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Local stand-in for the Shopware REST API.
+
+It answers the resources used by the adapters of the connector
+(``articles``, ``variants``, ``categories``, ``customers``,
+``addresses``, ``orders``, ``shops``, ``CustomerGroups``), so the
+importers and exporters can be run and measured without a Shopware
+instance.
+
+The data is either generated::
+
+    $ python benchmark/stand_in.py --articles 10000 --variants 3 \\
+        --customers 1000 --orders 1000 --latency 0.02
+
+or replayed from a cassette written by ``ShopwareBackend.output_recorder``::
+
+    $ python benchmark/stand_in.py --cassette /tmp/output_db_2017.ndjson
+
+The backend location is then ``http://localhost:8090`` (any username and
+API key are accepted).
+
+``GET /__stats__`` returns the number of requests per resource,
+``POST /__reset__`` resets them.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+except ImportError:  # python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+DATE_RE = re.compile(r'^\d{4}[-/]\d{2}[-/]\d{2}[T ]\d{2}:\d{2}:\d{2}')
+# responses larger than this number of bytes are compressed when the
+# client accepts gzip
+GZIP_MIN_SIZE = 1024
+
+
+def parse_php_query(query):
+    """ Parse a query string using the ``key[sub][subsub]=value``
+    notation of PHP to nested dicts """
+    result = {}
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', name)
+        if not parts:
+            continue
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if not isinstance(node, dict):
+                break
+        else:
+            node[parts[-1]] = value
+    return result
+
+
+def flatten_params(arguments, prefix=None):
+    """ Same notation as ``php_params`` of the connector, used to match
+    the calls of a cassette with the incoming query strings """
+    if isinstance(arguments, dict):
+        items = arguments.items()
+    elif isinstance(arguments, (list, tuple)):
+        items = enumerate(arguments)
+    else:
+        return [(prefix, arguments)]
+    params = []
+    for key, value in items:
+        name = '%s[%s]' % (prefix, key) if prefix else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            params.extend(flatten_params(value, prefix=name))
+        elif isinstance(value, bool):
+            params.append((name, str(int(value))))
+        elif value is not None:
+            params.append((name, u'%s' % (value,)))
+    return params
+
+
+def _comparable(value):
+    """ Turn a value in something which compares like Shopware does """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    value = u'%s' % (value,)
+    if DATE_RE.match(value):
+        return value[:19].replace('/', '-').replace(' ', 'T')
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+OPERATORS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    'LIKE': lambda a, b: u'%s' % b.strip('%') in u'%s' % a,
+    'IN': lambda a, b: a in b,
+}
+
+
+def _get_path(record, path):
+    for part in path.split('.'):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
+
+
+def match_filters(record, filters):
+    """ Evaluate the filters of a list or search request on a record.
+
+    Both the Shopware notation (``{'property', 'expression', 'value'}``)
+    and the legacy one of the orders search (``{'created_at': {'from':
+    ...}}``) are understood.
+    """
+    if not isinstance(filters, dict):
+        return True
+    for key, condition in filters.items():
+        if isinstance(condition, dict) and 'property' in condition:
+            value = _get_path(record, condition['property'])
+            expression = condition.get('expression', '=').upper()
+            if expression == 'IN':
+                expected = [_comparable(item) for item
+                            in condition.get('value', {}).values()]
+            else:
+                expected = _comparable(condition.get('value'))
+            if value is None:
+                return False
+            if not OPERATORS[expression](_comparable(value), expected):
+                return False
+        elif key == 'filters':
+            if not match_filters(record, condition):
+                return False
+        elif isinstance(condition, dict) and key in record:
+            value = _comparable(record[key])
+            for operator, expected in condition.items():
+                if operator in ('from', 'gteq'):
+                    ok = value >= _comparable(expected)
+                elif operator in ('to', 'lteq'):
+                    ok = value <= _comparable(expected)
+                elif operator == 'eq':
+                    ok = value == _comparable(expected)
+                elif operator == 'neq':
+                    ok = value != _comparable(expected)
+                elif operator == 'in':
+                    values = (expected.values()
+                              if isinstance(expected, dict) else expected)
+                    ok = value in [_comparable(item) for item in values]
+                else:
+                    ok = True
+                if not ok:
+                    return False
+    return True
+
+
+class Store(object):
+    """ The records served by the stand-in, per resource and id """
+
+    def __init__(self):
+        self.resources = defaultdict(OrderedDict)
+        self.cassette = {}
+        self.lock = threading.Lock()
+
+    def add(self, resource, record):
+        self.resources[resource][int(record['id'])] = record
+
+    def get(self, resource, record_id):
+        try:
+            return self.resources[resource].get(int(record_id))
+        except ValueError:
+            return None
+
+    def search(self, resource, arguments):
+        records = self.resources[resource].values()
+        filters = arguments.get('filter')
+        if filters:
+            records = [record for record in records
+                       if match_filters(record, filters)]
+        sort = arguments.get('sort')
+        if sort:
+            for order in reversed(list(sort.values())):
+                records = sorted(
+                    records,
+                    key=lambda rec: _comparable(
+                        _get_path(rec, order.get('property', 'id'))),
+                    reverse=order.get('direction', 'ASC').upper() == 'DESC')
+        total = len(records)
+        start = int(arguments.get('start') or 0)
+        limit = arguments.get('limit')
+        if limit:
+            records = records[start:start + int(limit)]
+        elif start:
+            records = records[start:]
+        return list(records), total
+
+    def load_cassette(self, filename):
+        """ Load the calls recorded by ``output_recorder`` """
+        with open(filename) as cassette:
+            for line in cassette:
+                line = line.strip()
+                if not line:
+                    continue
+                call = json.loads(line)
+                self.cassette[self.cassette_key(
+                    call['method'], call['resource'],
+                    flatten_params(call['arguments'] or {}))
+                ] = call['result']
+                # the records read are also served by their path
+                # whatever the parameters
+                parts = call['resource'].split('/')
+                if (call['method'] == 'GET' and len(parts) == 2 and
+                        isinstance(call['result'], dict) and
+                        parts[1].isdigit()):
+                    record = dict(call['result'], id=int(parts[1]))
+                    self.add(parts[0], record)
+
+    @staticmethod
+    def cassette_key(method, resource, params):
+        return (method, resource,
+                tuple(sorted((name, u'%s' % value)
+                             for name, value in params)))
+
+
+class Generator(object):
+    """ Generate a synthetic shop """
+
+    def __init__(self, store, seed=42):
+        self.store = store
+        self.random = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+
+    def _date(self, max_days=365):
+        delta = timedelta(seconds=self.random.randint(0, max_days * 86400))
+        return (self.now - delta).strftime(DATE_FORMAT)
+
+    def generate(self, categories=50, articles=1000, variants=1,
+                 customers=1000, orders=1000, lines=3):
+        store = self.store
+        store.add('shops', {'id': 1, 'name': 'Stand-in Shop',
+                            'active': True, 'position': 0})
+        store.add('CustomerGroups', {'id': 1, 'key': 'EK',
+                                     'name': 'Shopkunden'})
+        store.add('categories', {'id': 1, 'name': 'Root', 'parentId': None,
+                                 'active': True, 'changed': self._date()})
+        for categ_id in range(2, categories + 2):
+            store.add('categories', {
+                'id': categ_id,
+                'name': 'Category %d' % categ_id,
+                'parentId': self.random.randint(1, categ_id - 1),
+                'active': True,
+                'changed': self._date(),
+            })
+        variant_id = 0
+        for article_id in range(1, articles + 1):
+            detail_ids = []
+            for index in range(variants):
+                variant_id += 1
+                detail_ids.append(variant_id)
+                store.add('variants', {
+                    'id': variant_id,
+                    'articleId': article_id,
+                    'number': 'SW%05d.%d' % (article_id, index),
+                    'additionalText': 'Variant %d' % index,
+                    'active': True,
+                    'ean': None,
+                    'weight': round(self.random.uniform(0.1, 10), 3),
+                    'inStock': self.random.randint(0, 500),
+                    'prices': [{'from': 1,
+                                'price': round(
+                                    self.random.uniform(1, 500), 2),
+                                'customerGroup': {'key': 'EK'}}],
+                })
+            store.add('articles', {
+                'id': article_id,
+                'name': 'Article %d' % article_id,
+                'description': 'Description of article %d' % article_id,
+                'descriptionLong': 'Long description %d' % article_id,
+                'active': True,
+                'changed': self._date(),
+                'categories': [
+                    {'id': self.random.randint(2, categories + 1)}
+                    for __ in range(self.random.randint(1, 3))
+                ] if categories else [],
+                'mainDetail': {'id': detail_ids[0]},
+                'details': [{'id': detail_id}
+                            for detail_id in detail_ids[1:]],
+            })
+        for customer_id in range(1, customers + 1):
+            changed = self._date()
+            store.add('customers', {
+                'id': customer_id,
+                'email': 'customer%d@example.com' % customer_id,
+                'firstname': 'First%d' % customer_id,
+                'middlename': None,
+                'lastname': 'Last%d' % customer_id,
+                'dob': None,
+                'created_at': changed.replace('T', ' '),
+                'updated_at': changed.replace('T', ' '),
+                'lastLogin': changed,
+                'taxvat': None,
+                'group_id': 1,
+                'shop_id': 1,
+                'shopId': 1,
+            })
+            store.add('addresses', self._address(customer_id, customer_id))
+        for order_id in range(1, orders + 1):
+            customer_id = self.random.randint(1, max(customers, 1))
+            created = self._date(30).replace('T', ' ')
+            items = []
+            for line in range(lines):
+                product_id = self.random.randint(1, max(variant_id, 1))
+                qty = self.random.randint(1, 5)
+                price = round(self.random.uniform(1, 500), 2)
+                items.append({
+                    'item_id': order_id * 100 + line,
+                    'product_id': product_id,
+                    'sku': 'SW%05d' % product_id,
+                    'name': 'Article %d' % product_id,
+                    'qty_ordered': qty,
+                    'product_type': 'simple',
+                    'product_options': None,
+                    'base_row_total': qty * price,
+                    'base_row_total_incl_tax': qty * price * 1.19,
+                    'row_total': qty * price,
+                    'row_total_incl_tax': qty * price * 1.19,
+                    'discount_amount': 0,
+                })
+            total = sum(item['row_total_incl_tax'] for item in items)
+            address = self._address(order_id, customer_id)
+            store.add('orders', {
+                'id': order_id,
+                'increment_id': '%09d' % order_id,
+                'order_id': order_id,
+                'state': 'new',
+                'status': 'pending',
+                'created_at': created,
+                'shop_id': 1,
+                'customer_id': customer_id,
+                'customer_email': 'customer%d@example.com' % customer_id,
+                'customer_is_guest': 0,
+                'grand_total': total,
+                'tax_amount': total * 0.19 / 1.19,
+                'payment': {'method': 'prepayment',
+                            'amount_paid': total},
+                'billing_address': address,
+                'shipping_address': address,
+                'items': items,
+                'imported': 0,
+            })
+
+    def _address(self, address_id, customer_id):
+        return {
+            'id': address_id,
+            'customer_address_id': address_id,
+            'customer_id': customer_id,
+            'firstname': 'First%d' % customer_id,
+            'middlename': None,
+            'lastname': 'Last%d' % customer_id,
+            'prefix': None,
+            'suffix': None,
+            'company': None,
+            'street': 'Street %d' % address_id,
+            'postcode': '%05d' % (address_id % 100000),
+            'city': 'City',
+            'region': None,
+            'country_id': 'DE',
+            'telephone': None,
+            'fax': None,
+            'is_default_billing': True,
+            'is_default_shipping': True,
+            'created_at': None,
+            'updated_at': None,
+        }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Answer the requests like the Shopware REST API """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        accept = self.headers.get('Accept-Encoding') or ''
+        if len(body) > GZIP_MIN_SIZE and 'gzip' in accept:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def _count(self, resource):
+        server = self.server
+        with server.store.lock:
+            server.stats[resource] += 1
+
+    def _throttled(self):
+        """ Whether the rate limit of the server is exceeded """
+        server = self.server
+        if not server.rate_limit:
+            return False
+        with server.store.lock:
+            now = int(time.time())
+            if server.window != now:
+                server.window = now
+                server.window_count = 0
+            server.window_count += 1
+            if server.window_count > server.rate_limit:
+                server.stats['__throttled__'] += 1
+                return True
+        return False
+
+    def _latency(self):
+        server = self.server
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+    def _route(self, method):
+        url = urlparse(self.path)
+        path = url.path
+        if path == '/__stats__':
+            return self._send(200, dict(self.server.stats))
+        if path == '/__reset__':
+            self.server.stats.clear()
+            return self._send(200, {'success': True})
+        if not path.startswith('/api/'):
+            return self._send(404, {'success': False,
+                                    'message': 'Unknown path'})
+        resource = path[len('/api/'):].strip('/')
+        body = self._body() if method != 'GET' else None
+        arguments = parse_php_query(url.query)
+        # names the resource the way the statistics group them
+        self._count(re.sub(r'/\d+$', '/<id>', resource))
+        if self._throttled():
+            return self._send(429, {'success': False,
+                                    'message': 'Too many requests'},
+                              headers={'Retry-After': '1'})
+        self._latency()
+
+        store = self.server.store
+        if store.cassette:
+            params = parse_qsl(url.query, keep_blank_values=True)
+            if body is not None:
+                params = flatten_params(body)
+            key = store.cassette_key(method, resource, params)
+            if key in store.cassette:
+                return self._send(200, {'success': True,
+                                        'data': store.cassette[key]})
+        handler = getattr(self, '_%s' % method.lower())
+        return handler(resource, arguments, body)
+
+    def _get(self, resource, arguments, body):
+        store = self.server.store
+        parts = resource.split('/')
+        if len(parts) == 2:
+            record = store.get(parts[0], parts[1])
+            if record is None:
+                return self._send(404, {'success': False,
+                                        'message': 'Record not found'})
+            return self._send(200, {'success': True, 'data': record})
+        if resource.endswith('Search'):
+            records, total = store.search(resource[:-len('Search')],
+                                          arguments)
+            return self._send(200, {
+                'success': True,
+                'data': [record['id'] for record in records],
+                'total': total,
+            })
+        if '.' in resource:
+            # legacy calls of the adapters (``orders.info``, ...)
+            name, action = resource.split('.', 1)
+            if action == 'info':
+                record = store.get(name, arguments.get('0'))
+                if record is None:
+                    return self._send(404, {'success': False,
+                                            'message': 'Record not found'})
+                return self._send(200, {'success': True, 'data': record})
+            if action == 'list':
+                filters = arguments.get('0') or {}
+                records, total = store.search(name, {'filter': filters})
+                return self._send(200, {'success': True, 'data': records,
+                                        'total': total})
+            return self._send(200, {'success': True, 'data': None})
+        records, total = store.search(resource, arguments)
+        return self._send(200, {'success': True, 'data': records,
+                                'total': total})
+
+    def _put(self, resource, arguments, body):
+        store = self.server.store
+        parts = resource.split('/')
+        if len(parts) == 2:
+            record = store.get(parts[0], parts[1])
+            if record is None:
+                return self._send(404, {'success': False,
+                                        'message': 'Record not found'})
+            record.update(body or {})
+            return self._send(200, {'success': True,
+                                    'data': {'id': record['id']}})
+        # batch mode: a list of records with their id
+        results = []
+        for values in body or []:
+            record = store.get(resource, values.get('id', 0))
+            if record is None:
+                results.append({'success': False,
+                                'message': 'Record not found'})
+                continue
+            record.update(values)
+            results.append({'success': True, 'operation': 'update',
+                            'data': {'id': record['id']}})
+        return self._send(200, {'success': True, 'data': results})
+
+    def _post(self, resource, arguments, body):
+        store = self.server.store
+        with store.lock:
+            records = store.resources[resource]
+            record_id = max(records) + 1 if records else 1
+            record = dict(body or {}, id=record_id)
+            store.add(resource, record)
+        return self._send(201, {'success': True,
+                                'data': {'id': record_id}})
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+    def do_POST(self):
+        self._route('POST')
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, store, latency=0.0, jitter=0.0,
+                 rate_limit=0, verbose=False):
+        HTTPServer.__init__(self, address, StandInHandler)
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.window = None
+        self.window_count = 0
+        self.verbose = verbose
+        self.stats = defaultdict(int)
+
+
+def make_server(host='localhost', port=8090, cassette=None, latency=0.0,
+                jitter=0.0, rate_limit=0, verbose=False, **sizes):
+    """ Build a stand-in server, serving a cassette or generated data
+
+    ``sizes`` are the arguments of :meth:`Generator.generate`.
+    """
+    store = Store()
+    if cassette:
+        store.load_cassette(cassette)
+    else:
+        Generator(store).generate(**sizes)
+    return StandInServer((host, port), store, latency=latency,
+                         jitter=jitter, rate_limit=rate_limit,
+                         verbose=verbose)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--cassette',
+                        help='replay the calls recorded in this file')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--articles', type=int, default=1000)
+    parser.add_argument('--variants', type=int, default=1,
+                        help='number of variants per article')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--lines', type=int, default=3,
+                        help='number of lines per order')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random seconds added to the latency')
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='requests per second answered, the next ones '
+                             'get a 429 response')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, cassette=args.cassette,
+                         latency=args.latency, jitter=args.jitter,
+                         rate_limit=args.rate_limit, verbose=args.verbose,
+                         categories=args.categories,
+                         articles=args.articles,
+                         variants=args.variants,
+                         customers=args.customers,
+                         orders=args.orders,
+                         lines=args.lines)
+    print('Shopware stand-in listening on http://%s:%d' % (args.host,
+                                                            args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ from . import connector
 from . import backend
 
 from . import shopware_model
+from . import api_state
+from . import metrics
+from . import response_cache
 from . import product
 from . import product_category
 from . import partner
@@ -15,4 +18,7 @@ from . import stock_picking
 from . import stock_tracking
 from . import payment_method
 
+from . import bootstrap
+from . import cli
 from . import consumer
+from . import controllers
@@ -31,7 +31,7 @@
              'product_m2mcategories',
              ],
  'external_dependencies': {
-     'python': ['shopware_rest'],
+     'python': ['requests'],
  },
  'demo': [],
  'data': ['setting_view.xml',
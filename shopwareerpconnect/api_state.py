@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+State of the Shopware API of a backend, shared by all the worker
+processes through a row of ``shopware_api_state``.
+
+It holds:
+
+* the token bucket limiting the requests per second sent to Shopware.
+  The rate of the bucket is adapted to the responses (AIMD): it is
+  increased a little after each successful call and halved when
+  Shopware answers with 429 / 503 or responds slowly.
+* the circuit breaker of the backend.  After a number of consecutive
+  network or gateway errors, the circuit is opened and the jobs are
+  postponed without calling Shopware.  Once the cooldown is elapsed, a
+  single call is let through (half-open): its success closes the
+  circuit, its failure opens it again.
+
+The row is always read and updated with a single statement in a
+dedicated autocommit cursor, so the jobs never hold a lock on it.
+"""
+
+import logging
+import math
+import time
+from collections import defaultdict
+from contextlib import closing
+
+import psycopg2
+
+import openerp
+from openerp import models, fields
+from openerp.addons.connector.exception import RetryableJobError
+
+_logger = logging.getLogger(__name__)
+
+# a job waits at most this number of seconds for a token, beyond it
+# is postponed
+MAX_THROTTLE_WAIT = 10
+# the adaptive rate never goes below this ratio of the configured rate
+MIN_RATE_RATIO = 0.05
+# factor applied to the rate on a 429 / 503 and on a slow response
+THROTTLED_DECREASE = 0.5
+SLOW_DECREASE = 0.8
+# the rate is decreased at most once in this number of seconds, the
+# responses of the calls sent meanwhile reflect the former rate
+DECREASE_INTERVAL = 2
+THROTTLED_STATUS_CODES = (429, 503)
+# responses counted as failures by the circuit breaker, with the
+# network errors
+UNREACHABLE_STATUS_CODES = (502, 503, 504)
+# a closed circuit is checked again in the database after this number
+# of seconds
+CIRCUIT_CHECK_INTERVAL = 1
+
+# successful calls since the last token taken, by (dbname, backend_id),
+# added to the rate when the next token is taken
+_successes = defaultdict(int)
+# last known state of the circuits, by (dbname, backend_id):
+# (state, failures, time of the check)
+_circuits = {}
+
+NOW = "extract(epoch from clock_timestamp())"
+
+
+class ShopwareApiState(models.Model):
+    _name = 'shopware.api.state'
+    _description = 'Shopware API State'
+    _rec_name = 'backend_id'
+
+    backend_id = fields.Many2one(
+        comodel_name='shopware.backend',
+        string='Shopware Backend',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+    )
+    tokens = fields.Float(readonly=True)
+    rate = fields.Float(
+        string='Current Rate',
+        readonly=True,
+        help="Requests per second currently allowed, adapted to the "
+             "responses of Shopware.",
+    )
+    last_refill = fields.Float(readonly=True)
+    last_decrease = fields.Float(readonly=True)
+    circuit_state = fields.Selection(
+        selection=[('closed', 'Closed'),
+                   ('open', 'Open'),
+                   ('half_open', 'Half-Open')],
+        string='Circuit',
+        default='closed',
+        required=True,
+        readonly=True,
+    )
+    failures = fields.Integer(
+        string='Consecutive Failures',
+        readonly=True,
+    )
+    opened_at = fields.Float(readonly=True)
+
+    _sql_constraints = [
+        ('backend_uniq', 'unique(backend_id)',
+         'A backend can have only one API state.'),
+    ]
+
+
+def autocommit_cursor(dbname):
+    """ Cursor outside of the transaction of the current job, each
+    statement is committed right away """
+    cr = openerp.sql_db.db_connect(dbname).cursor()
+    cr.autocommit(True)
+    return closing(cr)
+
+
+def _create_state(cr, backend_id, max_rate):
+    """ Insert the row of a backend, the callers update it afterwards """
+    try:
+        cr.execute("INSERT INTO shopware_api_state "
+                   "(backend_id, tokens, rate, last_refill, "
+                   " last_decrease, circuit_state, failures, opened_at) "
+                   "VALUES (%s, %s, %s, " + NOW + ", 0, 'closed', 0, 0)",
+                   (backend_id, max(max_rate, 1.), max_rate))
+    except psycopg2.IntegrityError:
+        # created meanwhile by another worker, or the backend
+        # is not committed yet
+        pass
+
+
+def _take_token(cr, backend_id, successes, max_rate):
+    cr.execute("UPDATE shopware_api_state "
+               "SET rate = CASE WHEN rate <= 0 THEN %(max_rate)s "
+               "           ELSE LEAST(%(max_rate)s, GREATEST(%(min_rate)s, "
+               "                      rate + %(successes)s / rate)) END, "
+               "    tokens = LEAST(%(burst)s, tokens + "
+               "                   GREATEST(0, " + NOW + " - last_refill) "
+               "                   * rate) - 1, "
+               "    last_refill = " + NOW + " "
+               "WHERE backend_id = %(backend_id)s "
+               "RETURNING tokens, rate",
+               {'max_rate': max_rate,
+                'min_rate': max_rate * MIN_RATE_RATIO,
+                'burst': max(max_rate, 1.),
+                'successes': successes,
+                'backend_id': backend_id})
+    return cr.fetchone()
+
+
+def throttle(dbname, backend_id, max_rate):
+    """ Take a token in the bucket of a backend before a call
+
+    When the bucket is empty, the token is reserved and the call waits
+    for it.  If the wait would exceed ``MAX_THROTTLE_WAIT``, the token
+    is given back and the job is postponed with a
+    :class:`RetryableJobError`.
+
+    :param max_rate: configured requests per second, no limit if 0
+    """
+    if not max_rate:
+        return
+    successes = _successes.pop((dbname, backend_id), 0)
+    with autocommit_cursor(dbname) as cr:
+        row = _take_token(cr, backend_id, successes, max_rate)
+        if row is None:
+            _create_state(cr, backend_id, max_rate)
+            row = _take_token(cr, backend_id, 0, max_rate)
+            if row is None:
+                return
+        tokens, rate = row
+        if tokens >= 0:
+            return
+        wait = -tokens / rate
+        if wait > MAX_THROTTLE_WAIT:
+            cr.execute("UPDATE shopware_api_state SET tokens = tokens + 1 "
+                       "WHERE backend_id = %s", (backend_id,))
+            raise RetryableJobError(
+                'The rate limit of %.1f requests per second to Shopware '
+                'is reached.' % rate,
+                seconds=int(math.ceil(wait)))
+    _logger.debug('throttled the call to Shopware for %.3fs '
+                  '(%.1f requests/s)', wait, rate)
+    time.sleep(wait)
+
+
+def report(dbname, backend_id, max_rate, status, seconds, slow_threshold=0):
+    """ Adapt the rate of a backend to the response of a call
+
+    :param status: HTTP status of the response, None on a network error
+    :param seconds: duration of the call
+    :param slow_threshold: calls longer than this number of seconds
+                           decrease the rate, ignored if 0
+    """
+    if not max_rate or status is None:
+        return
+    if status in THROTTLED_STATUS_CODES:
+        factor = THROTTLED_DECREASE
+    elif slow_threshold and seconds > slow_threshold:
+        factor = SLOW_DECREASE
+    else:
+        if status < 400:
+            _successes[(dbname, backend_id)] += 1
+        return
+    _successes.pop((dbname, backend_id), None)
+    with autocommit_cursor(dbname) as cr:
+        cr.execute("UPDATE shopware_api_state "
+                   "SET rate = GREATEST(%s, rate * %s), "
+                   "    tokens = LEAST(tokens, 0), "
+                   "    last_decrease = " + NOW + " "
+                   "WHERE backend_id = %s "
+                   "AND last_decrease < " + NOW + " - %s "
+                   "RETURNING rate",
+                   (max_rate * MIN_RATE_RATIO, factor, backend_id,
+                    DECREASE_INTERVAL))
+        row = cr.fetchone()
+    if row:
+        _logger.info('Shopware answered with status %s in %.3fs, rate '
+                     'lowered to %.1f requests/s', status, seconds, row[0])
+
+
+def check_circuit(dbname, backend_id, cooldown):
+    """ Check the circuit of a backend before a call
+
+    When the circuit is open, the job is postponed until the end of the
+    cooldown with a :class:`RetryableJobError` which does not count as
+    a retry.  When the cooldown is elapsed, the first caller probes
+    Shopware and the others keep waiting.
+    """
+    key = (dbname, backend_id)
+    known = _circuits.get(key)
+    if (known and known[0] == 'closed' and
+            time.time() - known[2] < CIRCUIT_CHECK_INTERVAL):
+        return
+    with autocommit_cursor(dbname) as cr:
+        cr.execute("UPDATE shopware_api_state "
+                   "SET circuit_state = 'half_open', "
+                   "    opened_at = " + NOW + " "
+                   "WHERE backend_id = %s "
+                   "AND circuit_state IN ('open', 'half_open') "
+                   "AND opened_at + %s <= " + NOW + " "
+                   "RETURNING failures",
+                   (backend_id, cooldown))
+        row = cr.fetchone()
+        if row:
+            _logger.info('probing the Shopware backend %s, its circuit '
+                         'is half-open', backend_id)
+            _circuits[key] = ('half_open', row[0], time.time())
+            return
+        cr.execute("SELECT circuit_state, failures, "
+                   "       opened_at + %s - " + NOW + " "
+                   "FROM shopware_api_state WHERE backend_id = %s",
+                   (cooldown, backend_id))
+        row = cr.fetchone()
+    if row is None:
+        _circuits[key] = ('closed', 0, time.time())
+        return
+    state, failures, remaining = row
+    _circuits[key] = (state, failures, time.time())
+    if state != 'closed':
+        raise RetryableJobError(
+            'Shopware is unreachable, the circuit of the backend is '
+            'open. The job is postponed.',
+            seconds=max(int(math.ceil(remaining)), 1),
+            ignore_retry=True)
+
+
+def report_circuit(dbname, backend_id, status, threshold, cooldown,
+                   max_rate=0):
+    """ Count the failures of the calls, open the circuit after
+    ``threshold`` consecutive failures and close it on a success
+
+    :param status: HTTP status of the response, None on a network error
+    """
+    if not threshold:
+        return
+    key = (dbname, backend_id)
+    known = _circuits.get(key)
+    if status is not None and status not in UNREACHABLE_STATUS_CODES:
+        if known and (known[0] != 'closed' or known[1]):
+            with autocommit_cursor(dbname) as cr:
+                cr.execute("UPDATE shopware_api_state "
+                           "SET circuit_state = 'closed', failures = 0 "
+                           "WHERE backend_id = %s "
+                           "RETURNING circuit_state", (backend_id,))
+            if known[0] != 'closed':
+                _logger.info('the circuit of the Shopware backend %s '
+                             'is closed', backend_id)
+            _circuits[key] = ('closed', 0, time.time())
+        return
+    with autocommit_cursor(dbname) as cr:
+        for __ in range(2):
+            cr.execute("UPDATE shopware_api_state "
+                       "SET failures = failures + 1, "
+                       "    circuit_state = CASE "
+                       "      WHEN circuit_state = 'half_open' "
+                       "        OR failures + 1 >= %(threshold)s "
+                       "      THEN 'open' ELSE circuit_state END, "
+                       "    opened_at = CASE "
+                       "      WHEN circuit_state = 'half_open' "
+                       "        OR (circuit_state = 'closed' "
+                       "            AND failures + 1 >= %(threshold)s) "
+                       "      THEN " + NOW + " ELSE opened_at END "
+                       "WHERE backend_id = %(backend_id)s "
+                       "RETURNING circuit_state, failures",
+                       {'threshold': threshold, 'backend_id': backend_id})
+            row = cr.fetchone()
+            if row:
+                break
+            _create_state(cr, backend_id, max_rate)
+    if not row:
+        return
+    state, failures = row
+    if state == 'open' and (not known or known[0] != 'open'):
+        _logger.warning('the circuit of the Shopware backend %s is open '
+                        'after %d failures, its jobs are postponed '
+                        'during %d seconds', backend_id, failures,
+                        cooldown)
+    _circuits[key] = (state, failures, time.time())
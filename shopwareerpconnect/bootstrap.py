@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Bootstrap of the catalog of a backend, without the job queue.
+
+The initial load of a large shop through the jobs costs a job, a read
+and a transaction per article and a read per detail.  The bootstrap
+reads the customer groups, the categories, the articles and the variants
+page by page with the list endpoints, and imports them in the same
+process with the usual importers, which receive the records already
+read.  A transaction is committed every ``commit_size`` records, the
+computation of the parents of the categories is done once at the end.
+
+The records already imported and not modified on Shopware are skipped
+by the importers, so a bootstrap which was interrupted can be run again.
+
+The list endpoints do not return all the keys needed by the importers:
+the list of the articles lacks their details, categories and main
+detail, so the articles are read again with ``read_many`` (concurrently
+or with the list endpoint, see :meth:`GenericAdapter.read_many`).  The
+bootstrap still saves the jobs and the transaction of each article.
+
+The button of the backend delays the bootstrap in a job.  A job run by a
+worker is subject to its ``limit_time_real`` and ``limit_time_cpu``, so
+the bootstrap of a large catalog is rather run by the
+``shopwarebootstrap`` command of the server (:mod:`.cli.bootstrap`), in a
+process without limits.
+"""
+
+import logging
+import time
+from collections import defaultdict
+from operator import itemgetter
+from openerp.addons.connector.connector import ConnectorUnit
+from openerp.addons.connector.exception import RetryableJobError
+from openerp.addons.connector.queue.job import job
+from openerp.addons.connector.session import ConnectorSession
+from .backend import shopware
+from .connector import get_environment
+from .unit.backend_adapter import GenericAdapter, project
+from .unit.binder import clear_identity_map
+from .unit.import_synchronizer import ShopwareImporter
+from .unit.mapper import source_fields
+
+_logger = logging.getLogger(__name__)
+
+# records per call to the list endpoints
+BOOTSTRAP_PAGE_SIZE = 500
+# records imported per transaction
+BOOTSTRAP_COMMIT_SIZE = 1000
+
+# order of the import: each model only depends on the previous ones
+BOOTSTRAP_MODELS = ('shopware.res.partner.category',
+                    'shopware.product.category',
+                    'shopware.article',
+                    'shopware.product.product',
+                    )
+# keys used by the importers which a listed record may lack: the
+# ``changed`` date only serves to skip the records up-to-date
+BOOTSTRAP_OPTIONAL_KEYS = ('changed',)
+
+
+@shopware
+class CatalogBootstrap(ConnectorUnit):
+    """ Import the catalog of a backend with bulk reads """
+    _model_name = ['shopware.backend']
+
+    def __init__(self, connector_env):
+        super(CatalogBootstrap, self).__init__(connector_env)
+        self.page_size = BOOTSTRAP_PAGE_SIZE
+        self.commit_size = BOOTSTRAP_COMMIT_SIZE
+        self._pending = 0
+
+    def run(self, page_size=None, commit_size=None):
+        """ Import the models of ``BOOTSTRAP_MODELS`` in order
+
+        :return: the statistics of the import of each model
+        :rtype: list
+        """
+        self.page_size = page_size or BOOTSTRAP_PAGE_SIZE
+        self.commit_size = commit_size or BOOTSTRAP_COMMIT_SIZE
+        stats = []
+        for model in BOOTSTRAP_MODELS:
+            stats.append(self._import_model(model))
+            if model == 'shopware.product.category':
+                # deferred by the context during the import
+                self.env['product.category']._parent_store_compute()
+            self._commit()
+        return stats
+
+    def _pages(self, model):
+        """ Pages of records of a model, ready for the importers """
+        if model == 'shopware.product.category':
+            # a page per level of the tree, the parents first
+            return self.category_levels(record for page in
+                                        self._list_pages(model)
+                                        for record in page)
+        return self._list_pages(model)
+
+    def _list_pages(self, model):
+        """ Read the records page by page, the records of the list
+        missing some keys needed by the importer are read again """
+        adapter = self.unit_for(GenericAdapter, model=model)
+        importer = self.unit_for(ShopwareImporter, model=model)
+        attributes = importer._read_fields()
+        required = self._required_keys(importer)
+        for records in adapter.list_pages(self.page_size):
+            complete = [record for record in records
+                        if required is None or
+                        all(key in record for key in required)]
+            if len(complete) != len(records):
+                _logger.debug('%d %s read again, the list misses some '
+                              'keys', len(records) - len(complete), model)
+                complete_ids = set(record['id'] for record in complete)
+                missing_ids = [record['id'] for record in records
+                               if record['id'] not in complete_ids]
+                complete += [result.record for result in
+                             adapter.read_many(missing_ids, attributes)
+                             if result.error is None]
+            yield [project(record, attributes) for record in complete]
+
+    @staticmethod
+    def _required_keys(importer):
+        """ Keys a listed record must have to be imported without
+        being read again, None when any record is complete: the ones
+        of the mapper, and the ones of the importer which are not
+        optional for a bootstrap """
+        keys = source_fields(importer.mapper)
+        if keys is None:
+            return None
+        return keys | set(importer._source_fields).difference(
+            BOOTSTRAP_OPTIONAL_KEYS)
+
+    @staticmethod
+    def category_levels(records):
+        """ Group the categories by level in the tree: the parents of
+        the categories of a level are in the previous levels
+
+        :rtype: list
+        """
+        records = list(records)
+        parents = dict((record['id'], record.get('parentId'))
+                       for record in records)
+
+        def depth(record):
+            level = 0
+            parent_id = record.get('parentId')
+            while parent_id and level < len(parents):
+                parent_id = parents.get(parent_id)
+                level += 1
+            return level
+        levels = defaultdict(list)
+        for record in records:
+            levels[depth(record)].append(record)
+        return [sorted(levels[level], key=itemgetter('id'))
+                for level in sorted(levels)]
+
+    def _import_model(self, model):
+        """ Import all the records of a model """
+        start = time.time()
+        done = failed = 0
+        for records in self._pages(model):
+            for record in records:
+                if self._import_record(model, record['id'], record):
+                    done += 1
+                else:
+                    failed += 1
+            _logger.info('bootstrap of %s: %d records done, %d failed',
+                         model, done, failed)
+        seconds = time.time() - start
+        stats = {'model': model,
+                 'done': done,
+                 'failed': failed,
+                 'seconds': seconds,
+                 'rate': done / seconds if seconds else 0.,
+                 }
+        _logger.info('bootstrap of %(model)s finished: %(done)d '
+                     'records in %(seconds).1fs (%(rate).1f/s), '
+                     '%(failed)d failed', stats)
+        return stats
+
+    def import_shard(self, model, shopware_ids, commit_size=None):
+        """ Read the records of a model at once and import them, used
+        by the processes of :mod:`.parallel`
+
+        :return: the number of records done and failed
+        """
+        self.commit_size = commit_size or BOOTSTRAP_COMMIT_SIZE
+        adapter = self.unit_for(GenericAdapter, model=model)
+        importer = self.unit_for(ShopwareImporter, model=model)
+        done = failed = 0
+        for shopware_id, record, error in adapter.read_many(
+                shopware_ids, attributes=importer._read_fields()):
+            # a failed read is done again by the import, which handles
+            # the missing records
+            if self._import_record(model, shopware_id,
+                                   record if error is None else None):
+                done += 1
+            else:
+                failed += 1
+        self._commit()
+        return done, failed
+
+    def _import_record(self, model, shopware_id, record=None):
+        """ Import a record in a savepoint, return whether it
+        succeeded """
+        importer = self.unit_for(ShopwareImporter, model=model)
+        try:
+            with self.session.cr.savepoint():
+                importer.run(shopware_id, record=record)
+        except RetryableJobError:
+            # Shopware is unreachable or the rate limit is reached, the
+            # bootstrap is stopped and can be run again
+            raise
+        except Exception as err:
+            self.env.invalidate_all()
+            clear_identity_map(self.session.cr)
+            _logger.info('bootstrap of %s %s failed: %s',
+                         model, shopware_id, err)
+            return False
+        self._pending += 1
+        if self._pending >= self.commit_size:
+            self._commit()
+        return True
+
+    def _commit(self):
+        self.session.commit()
+        # the cache of the environment grows with each record
+        self.env.invalidate_all()
+        self._pending = 0
+
+
+def bootstrap_context(context):
+    """ Context of the imports of a bootstrap """
+    return dict(context or {},
+                shopware_bootstrap=True,
+                connector_no_export=True,
+                defer_parent_store_computation=True,
+                tracking_disable=True,
+                mail_create_nolog=True,
+                )
+
+
+def bootstrap_catalog(session, backend_id, page_size=None,
+                      commit_size=None):
+    """ Import the catalog of a backend directly, see
+    :class:`CatalogBootstrap` """
+    session = ConnectorSession(session.cr, session.uid,
+                               context=bootstrap_context(session.context))
+    env = get_environment(session, 'shopware.backend', backend_id)
+    bootstrap = env.get_connector_unit(CatalogBootstrap)
+    return bootstrap.run(page_size=page_size, commit_size=commit_size)
+
+
+@job(default_channel='root.shopware')
+def bootstrap_catalog_job(session, model_name, backend_id):
+    """ Bootstrap of the catalog of a backend delayed by its form, see
+    :meth:`~.ShopwareBackend.run_bootstrap_catalog` """
+    backend = session.env[model_name].browse(backend_id)
+    backend.run_bootstrap_catalog()
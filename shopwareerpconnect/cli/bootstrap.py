@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+``shopwarebootstrap`` command of the server: bootstrap of the catalog of
+a backend in a process of its own, without the time limits of the
+workers::
+
+    $ openerp-server --addons-path=... shopwarebootstrap -c odoo.cfg \
+        -d database --backend 1
+
+The server only finds the commands of the addons given by the
+``--addons-path`` passed as first argument.
+"""
+
+import argparse
+import logging
+import openerp
+from openerp import api, SUPERUSER_ID
+from openerp.cli import Command
+
+_logger = logging.getLogger(__name__)
+
+
+class ShopwareBootstrap(Command):
+    """ Import the catalog of a Shopware backend, see
+    :meth:`~.ShopwareBackend.run_bootstrap_catalog` """
+
+    def run(self, args):
+        parser = argparse.ArgumentParser(
+            prog='openerp-server shopwarebootstrap',
+            description='Import the catalog of a Shopware backend')
+        parser.add_argument('-c', '--config', help='Odoo configuration file')
+        parser.add_argument('-d', '--database', required=True)
+        parser.add_argument('--backend', type=int, required=True,
+                            help='id of the Shopware backend')
+        parser.add_argument('--processes', type=int,
+                            help='number of processes, the one configured '
+                                 'on the backend by default')
+        args = parser.parse_args(args)
+
+        odoo_args = ['-d', args.database]
+        if args.config:
+            odoo_args += ['-c', args.config]
+        openerp.tools.config.parse_config(odoo_args)
+        openerp.netsvc.init_logger()
+
+        registry = openerp.modules.registry.RegistryManager.get(
+            args.database)
+        with api.Environment.manage():
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                backend = env['shopware.backend'].browse(
+                    args.backend).exists()
+                if not backend:
+                    parser.error('no Shopware backend with the id %d' %
+                                 args.backend)
+                _logger.info('bootstrap of the catalog of the backend %s',
+                             backend.name)
+                backend.run_bootstrap_catalog(processes=args.processes)
@@ -57,6 +57,13 @@ class ShopwareBinding(models.AbstractModel):
     )
     # fields.Char because 0 is a valid Shopware ID
     shopware_id = fields.Char(string='ID on Shopware')
+    shopware_hash = fields.Char(
+        string='Fingerprint on Shopware',
+        readonly=True,
+        help="Hash of the content of the record on Shopware at the "
+             "last import, used to skip the imports of unchanged "
+             "records.",
+    )
 
     _sql_constraints = [
         ('shopware_uniq', 'unique(backend_id, shopware_id)',
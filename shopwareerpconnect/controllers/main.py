@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import hashlib
+import hmac
+import json
+import logging
+import re
+
+from openerp import SUPERUSER_ID, http
+from openerp.http import request
+
+from ..metrics import format_prometheus
+
+_logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Shopware-Signature'
+# hexadecimal HMAC-SHA256
+SIGNATURE_RE = re.compile(r'[0-9a-fA-F]{64}\Z')
+
+
+def valid_signature(secret, body, received):
+    """ Return whether ``received`` is the HMAC-SHA256 of the body
+    with the secret of the backend
+
+    A malformed signature is refused before the comparison, which only
+    accepts ASCII.
+    """
+    if not isinstance(received, basestring) or \
+            not SIGNATURE_RE.match(received):
+        return False
+    signature = hmac.new(secret.encode('utf-8'), body,
+                         hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, str(received).lower())
+
+
+class ShopwareMetrics(http.Controller):
+
+    @http.route('/shopware/metrics', type='http', auth='user')
+    def metrics(self, **kwargs):
+        """ Metrics of the calls to the Shopware API done by all the
+        worker processes, in the text format of Prometheus
+        """
+        return request.make_response(
+            format_prometheus(request.cr.dbname),
+            headers=[('Content-Type', 'text/plain; version=0.0.4')])
+
+
+class ShopwareWebhook(http.Controller):
+
+    @http.route('/shopware/webhook/<int:backend_id>', type='http',
+                auth='none', methods=['POST'])
+    def webhook(self, backend_id, **kwargs):
+        """ Receive the events sent by Shopware and delay the import of
+        the records they concern
+
+        The body is a JSON object ``{"event": "order.placed", "id": 42}``
+        or a list of them.  It is signed with the secret of the backend:
+        the ``X-Shopware-Signature`` header is the hexadecimal HMAC-SHA256
+        of the body.
+
+        The request has no session: the database is the one selected
+        by the ``dbfilter`` of the server for the host of the URL, so
+        the server must select a single database per host.
+        """
+        env = request.env(user=SUPERUSER_ID)
+        backend = env['shopware.backend'].browse(backend_id).exists()
+        if not backend or not backend.webhook_secret:
+            return self._reply(404, 'Unknown backend')
+        body = request.httprequest.get_data()
+        received = request.httprequest.headers.get(SIGNATURE_HEADER, '')
+        if not valid_signature(backend.webhook_secret, body, received):
+            _logger.warning('refused an event for the Shopware backend %s: '
+                            'invalid signature', backend_id)
+            return self._reply(403, 'Invalid signature')
+        try:
+            events = json.loads(body)
+            if isinstance(events, dict):
+                events = [events]
+            events = [(event['event'], int(event['id'])) for event in events]
+        except (ValueError, TypeError, KeyError):
+            return self._reply(400, 'Invalid event')
+        delayed = 0
+        for event, shopware_id in events:
+            if backend.import_webhook_event(event, shopware_id):
+                delayed += 1
+            else:
+                _logger.info('ignored the unknown Shopware event %s', event)
+        return self._reply(202, 'Accepted', jobs=delayed)
+
+    def _reply(self, status, message, **values):
+        values.update(success=status < 400, message=message)
+        response = request.make_response(
+            json.dumps(values),
+            headers=[('Content-Type', 'application/json')])
+        response.status_code = status
+        return response
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Metrics of the calls to the Shopware API.
+
+Every call done by :meth:`ShopwareCRUDAdapter._call` is observed in a
+histogram per backend and resource.  Each worker process counts its
+calls in memory and adds them to the rows of ``shopware_api_metric``
+every ``FLUSH_INTERVAL`` seconds, so the metrics are the totals of all
+the processes.  They can be read on the form of the backend and with the
+``/shopware/metrics`` endpoint, in the text format of Prometheus.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+
+from openerp import models, fields
+from .api_state import autocommit_cursor
+
+_logger = logging.getLogger(__name__)
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+OUTCOMES = ('success', 'missing', 'retry', 'error')
+
+# seconds between two additions of the calls of a process to the
+# shared metrics
+FLUSH_INTERVAL = 10
+
+
+class ShopwareApiMetric(models.Model):
+    """ A counter of the calls to a resource, summed over the worker
+    processes """
+    _name = 'shopware.api.metric'
+    _description = 'Shopware API Metric'
+    _rec_name = 'resource'
+
+    backend_id = fields.Many2one(
+        comodel_name='shopware.backend',
+        string='Shopware Backend',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+    )
+    resource = fields.Char(required=True, readonly=True)
+    method = fields.Char(required=True, readonly=True)
+    # count, seconds, bytes_in, bytes_out, retries, or bucket, status
+    # and outcome with a label
+    series = fields.Char(required=True, readonly=True)
+    label = fields.Char(readonly=True)
+    value = fields.Float(readonly=True)
+
+    _sql_constraints = [
+        ('series_uniq',
+         'unique(backend_id, resource, method, series, label)',
+         'A series of a backend can have only one row.'),
+    ]
+
+
+class ResourceMetrics(object):
+    """ Counters and latency histogram of the calls to a resource """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.statuses = defaultdict(int)
+        self.outcomes = defaultdict(int)
+        self.retries = 0
+
+    def observe(self, status, bytes_in, bytes_out, seconds, outcome):
+        self.count += 1
+        self.seconds += seconds
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+        self.statuses[status] += 1
+        self.outcomes[outcome] += 1
+
+    def quantile(self, quantile):
+        """ Upper bound of the bucket containing the quantile """
+        if not self.count:
+            return None
+        rank = quantile * self.count
+        seen = 0
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def series(self):
+        """ Yield the (series, label, value) of the counters, as
+        stored in ``shopware_api_metric`` """
+        yield 'count', '', self.count
+        yield 'seconds', '', self.seconds
+        yield 'bytes_in', '', self.bytes_in
+        yield 'bytes_out', '', self.bytes_out
+        yield 'retries', '', self.retries
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            yield 'bucket', str(bound), count
+        for status, count in self.statuses.iteritems():
+            if status is not None:
+                yield 'status', str(status), count
+        for outcome, count in self.outcomes.iteritems():
+            yield 'outcome', outcome, count
+
+    def add_series(self, series, label, value):
+        if series == 'bucket':
+            bounds = [str(bound) for bound in LATENCY_BUCKETS]
+            if label in bounds:
+                self.buckets[bounds.index(label)] += int(value)
+        elif series == 'status':
+            self.statuses[int(label)] += int(value)
+        elif series == 'outcome':
+            self.outcomes[label] += int(value)
+        elif series == 'seconds':
+            self.seconds += value
+        elif series in ('count', 'bytes_in', 'bytes_out', 'retries'):
+            setattr(self, series, getattr(self, series) + int(value))
+
+
+# calls not added to the shared metrics yet
+# {(dbname, backend_id): {(resource, method): ResourceMetrics}}
+metrics = defaultdict(lambda: defaultdict(ResourceMetrics))
+_metrics_lock = threading.Lock()
+# time of the last flush, by dbname
+_flushed = {}
+
+_ID_RE = re.compile(r'/\d+(?=/|$)')
+
+
+def resource_name(resource):
+    """ Group the calls to the records of a resource,
+    ``articles/42`` becomes ``articles/<id>`` """
+    return _ID_RE.sub('/<id>', resource)
+
+
+def observe(dbname, backend_id, resource, method, status,
+            bytes_in, bytes_out, seconds, outcome):
+    """ Add a call to the metrics of a backend """
+    key = (resource_name(resource), method)
+    with _metrics_lock:
+        metrics[(dbname, backend_id)][key].observe(
+            status, bytes_in, bytes_out, seconds, outcome)
+    if time.time() - _flushed.get(dbname, 0) > FLUSH_INTERVAL:
+        flush(dbname)
+
+
+def observe_retry(dbname, backend_id, resource, method):
+    """ Count a call sent again after a failure """
+    key = (resource_name(resource), method)
+    with _metrics_lock:
+        metrics[(dbname, backend_id)][key].retries += 1
+
+
+def _add_series(cr, backend_id, resource, method, series, label, value):
+    params = {'backend_id': backend_id, 'resource': resource,
+              'method': method, 'series': series, 'label': label,
+              'value': value}
+    for __ in range(2):
+        cr.execute("UPDATE shopware_api_metric "
+                   "SET value = value + %(value)s "
+                   "WHERE backend_id = %(backend_id)s "
+                   "AND resource = %(resource)s AND method = %(method)s "
+                   "AND series = %(series)s AND label = %(label)s",
+                   params)
+        if cr.rowcount:
+            return
+        try:
+            cr.execute("INSERT INTO shopware_api_metric "
+                       "(backend_id, resource, method, series, label, "
+                       " value) "
+                       "VALUES (%(backend_id)s, %(resource)s, %(method)s, "
+                       "        %(series)s, %(label)s, %(value)s)",
+                       params)
+            return
+        except psycopg2.IntegrityError:
+            # created meanwhile by another worker, or the backend
+            # is not committed yet
+            pass
+
+
+def flush(dbname):
+    """ Add the calls of the process to the shared metrics """
+    with _metrics_lock:
+        _flushed[dbname] = time.time()
+        pending = [(key[1], metrics.pop(key)) for key in metrics.keys()
+                   if key[0] == dbname]
+    if not pending:
+        return
+    try:
+        with autocommit_cursor(dbname) as cr:
+            for backend_id, resources in pending:
+                for (resource, method), stats in resources.iteritems():
+                    for series, label, value in stats.series():
+                        if value:
+                            _add_series(cr, backend_id, resource, method,
+                                        series, label, value)
+    except psycopg2.Error:
+        # the metrics must never fail a synchronization
+        _logger.warning('could not add the metrics of the calls to '
+                        'Shopware', exc_info=True)
+
+
+def _read_metrics(dbname, backend_id=None):
+    """ Shared metrics, by backend and (resource, method) """
+    flush(dbname)
+    query = ("SELECT backend_id, resource, method, series, label, value "
+             "FROM shopware_api_metric")
+    params = ()
+    if backend_id is not None:
+        query += " WHERE backend_id = %s"
+        params = (backend_id,)
+    backends = defaultdict(lambda: defaultdict(ResourceMetrics))
+    with autocommit_cursor(dbname) as cr:
+        cr.execute(query, params)
+        for backend, resource, method, series, label, value in cr.fetchall():
+            backends[backend][(resource, method)].add_series(
+                series, label, value)
+    return backends
+
+
+def backend_metrics(dbname, backend_id):
+    """ Return the metrics of a backend, by (resource, method) """
+    return dict(_read_metrics(dbname, backend_id).get(backend_id, {}))
+
+
+def reset_metrics(dbname, backend_id):
+    with _metrics_lock:
+        metrics.pop((dbname, backend_id), None)
+    with autocommit_cursor(dbname) as cr:
+        cr.execute("DELETE FROM shopware_api_metric WHERE backend_id = %s",
+                   (backend_id,))
+
+
+def summary(dbname, backend_id):
+    """ Summary of the metrics of a backend, a list of dicts sorted
+    by the time spent on the resources """
+    rows = []
+    for (resource, method), stats in backend_metrics(dbname,
+                                                     backend_id).iteritems():
+        if not stats.count:
+            continue
+        rows.append({
+            'resource': resource,
+            'method': method,
+            'calls': stats.count,
+            'retries': stats.retries,
+            'seconds': stats.seconds,
+            'average_ms': stats.seconds * 1000 / stats.count,
+            'p95_ms': stats.quantile(0.95) * 1000,
+            'kb_in': stats.bytes_in / 1024.,
+            'kb_out': stats.bytes_out / 1024.,
+            'outcomes': dict((outcome, stats.outcomes[outcome])
+                             for outcome in OUTCOMES
+                             if stats.outcomes[outcome]),
+        })
+    rows.sort(key=lambda row: row['seconds'], reverse=True)
+    return rows
+
+
+def format_prometheus(dbname):
+    """ Metrics of all the backends of a database in the text format
+    of Prometheus """
+    backends = [(backend_id, dict(values)) for backend_id, values
+                in _read_metrics(dbname).iteritems()]
+    lines = [
+        '# HELP shopware_api_calls_total Calls to the Shopware API',
+        '# TYPE shopware_api_calls_total counter',
+        '# HELP shopware_api_responses_total HTTP status of the responses '
+        'of the Shopware API',
+        '# TYPE shopware_api_responses_total counter',
+        '# HELP shopware_api_retries_total Calls to the Shopware API '
+        'sent again after a failure',
+        '# TYPE shopware_api_retries_total counter',
+        '# HELP shopware_api_bytes_total Bytes exchanged with the '
+        'Shopware API',
+        '# TYPE shopware_api_bytes_total counter',
+        '# HELP shopware_api_latency_seconds Latency of the calls to the '
+        'Shopware API',
+        '# TYPE shopware_api_latency_seconds histogram',
+    ]
+    for backend_id, resources in sorted(backends):
+        for (resource, method), stats in sorted(resources.iteritems()):
+            labels = 'backend="%s",resource="%s",method="%s"' % (
+                backend_id, resource, method)
+            for outcome in OUTCOMES:
+                if stats.outcomes[outcome]:
+                    lines.append(
+                        'shopware_api_calls_total{%s,outcome="%s"} %d' %
+                        (labels, outcome, stats.outcomes[outcome]))
+            for status, count in sorted(stats.statuses.iteritems()):
+                if status is not None:
+                    lines.append(
+                        'shopware_api_responses_total{%s,status="%s"} %d' %
+                        (labels, status, count))
+            if stats.retries:
+                lines.append('shopware_api_retries_total{%s} %d' %
+                             (labels, stats.retries))
+            lines.append('shopware_api_bytes_total{%s,direction="in"} %d' %
+                         (labels, stats.bytes_in))
+            lines.append('shopware_api_bytes_total{%s,direction="out"} %d' %
+                         (labels, stats.bytes_out))
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(
+                    'shopware_api_latency_seconds_bucket{%s,le="%s"} %d' %
+                    (labels, bound, cumulative))
+            lines.append(
+                'shopware_api_latency_seconds_bucket{%s,le="+Inf"} %d' %
+                (labels, stats.count))
+            lines.append('shopware_api_latency_seconds_sum{%s} %f' %
+                         (labels, stats.seconds))
+            lines.append('shopware_api_latency_seconds_count{%s} %d' %
+                         (labels, stats.count))
+    return '\n'.join(lines) + '\n'
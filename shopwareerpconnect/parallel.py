@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Bootstrap of the catalog in several processes, for the offline loads
+of large shops.
+
+The coordinator reads the ids of the records, splits them in shards of
+``shard_size`` ids and hands the shards to a pool of processes.  The
+models of ``BOOTSTRAP_MODELS`` are imported one after the other, and the
+categories one level of the tree after the other, so the dependencies of
+a record are always imported before it.  Each process has its own
+cursors and its own clients of the Shopware API; it reads the records of
+a shard at once and imports them with ``ShopwareImporter.run``, like
+:mod:`.bootstrap`.
+
+The processes are forked from the coordinator, which must run in a
+process doing nothing else: the ``shopwarebootstrap`` command of the
+server (:mod:`.cli.bootstrap`), never a worker answering requests or
+running jobs.  They inherit its registry and its database connections,
+``_init_process`` drops the connections so each process opens its own.
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+import openerp
+from openerp import api
+from openerp.addons.connector.session import ConnectorSession
+from .bootstrap import (CatalogBootstrap,
+                        BOOTSTRAP_MODELS,
+                        bootstrap_context,
+                        )
+from .connector import get_environment
+from .unit.backend_adapter import GenericAdapter, forget_session_pools
+from .unit.import_synchronizer import chunked
+
+_logger = logging.getLogger(__name__)
+
+# ids imported by a process at a time
+SHARD_SIZE = 500
+
+# database pools inherited from the coordinator, kept referenced so
+# their connections are never closed by the processes
+_inherited_db_pools = []
+
+
+def _init_process():
+    """ Drop the connections inherited from the coordinator, each
+    process opens its own """
+    _inherited_db_pools.append(openerp.sql_db._Pool)
+    openerp.sql_db._Pool = None
+    forget_session_pools()
+
+
+def _cursor(dbname):
+    # not ``registry.cursor()``, the registry keeps the database pool
+    # of the process which loaded it
+    return openerp.sql_db.db_connect(dbname).cursor()
+
+
+def _import_shard(task):
+    """ Import a shard of ids, run in the processes of the pool """
+    (dbname, uid, context, backend_id,
+     model, shard, shopware_ids, commit_size) = task
+    start = time.time()
+    cr = _cursor(dbname)
+    try:
+        with api.Environment.manage():
+            session = ConnectorSession(cr, uid, context=context)
+            env = get_environment(session, 'shopware.backend', backend_id)
+            bootstrap = env.get_connector_unit(CatalogBootstrap)
+            done, failed = bootstrap.import_shard(model, shopware_ids,
+                                                  commit_size=commit_size)
+    finally:
+        cr.close()
+    seconds = time.time() - start
+    return {'model': model,
+            'shard': shard,
+            'pid': os.getpid(),
+            'done': done,
+            'failed': failed,
+            'seconds': seconds,
+            'rate': done / seconds if seconds else 0.,
+            }
+
+
+def _model_batches(dbname, uid, context, backend_id, model):
+    """ Lists of ids of a model to import one after the other, listed
+    with the list endpoint like :class:`CatalogBootstrap` """
+    cr = _cursor(dbname)
+    try:
+        with api.Environment.manage():
+            session = ConnectorSession(cr, uid, context=context)
+            env = get_environment(session, model, backend_id)
+            adapter = env.get_connector_unit(GenericAdapter)
+            if model == 'shopware.product.category':
+                records = [record for page in
+                           adapter.list_pages(SHARD_SIZE,
+                                              attributes=['id', 'parentId'])
+                           for record in page]
+                return [[record['id'] for record in level]
+                        for level in CatalogBootstrap.category_levels(
+                            records)]
+            return [[record['id'] for page in
+                     adapter.list_pages(SHARD_SIZE, attributes=['id'])
+                     for record in page]]
+    finally:
+        cr.close()
+
+
+def _compute_category_parents(dbname, uid, context):
+    cr = _cursor(dbname)
+    try:
+        with api.Environment.manage():
+            env = api.Environment(cr, uid, context)
+            env['product.category']._parent_store_compute()
+            cr.commit()
+    finally:
+        cr.close()
+
+
+def import_parallel(dbname, uid, backend_id, processes=None,
+                    shard_size=SHARD_SIZE, commit_size=None, context=None):
+    """ Import the catalog of a backend with a pool of processes
+
+    The records are imported in transactions of their own, the caller
+    must have committed the configuration of the backend.
+
+    :param processes: number of processes, the number of CPUs by default
+    :return: the statistics of the import of each model
+    :rtype: list
+    """
+    processes = processes or multiprocessing.cpu_count()
+    context = bootstrap_context(context)
+    # the processes inherit the registry and the connections of the
+    # coordinator, they drop the connections in ``_init_process``
+    pool = multiprocessing.Pool(processes, initializer=_init_process)
+    stats = []
+    try:
+        for model in BOOTSTRAP_MODELS:
+            start = time.time()
+            batches = _model_batches(dbname, uid, context, backend_id,
+                                     model)
+            total = sum(len(batch) for batch in batches)
+            done = failed = 0
+            for batch in batches:
+                tasks = [(dbname, uid, context, backend_id,
+                          model, shard, shopware_ids, commit_size)
+                         for shard, shopware_ids in
+                         enumerate(chunked(batch, shard_size))]
+                for shard_stats in pool.imap_unordered(_import_shard,
+                                                       tasks):
+                    done += shard_stats['done']
+                    failed += shard_stats['failed']
+                    _logger.info('bootstrap of %s: %d/%d records, %d '
+                                 'failed; shard %d: %d records in %.1fs '
+                                 '(%.1f/s) in process %d', model,
+                                 done + failed, total, failed,
+                                 shard_stats['shard'], shard_stats['done'],
+                                 shard_stats['seconds'],
+                                 shard_stats['rate'], shard_stats['pid'])
+            if model == 'shopware.product.category':
+                # deferred by the context during the import
+                _compute_category_parents(dbname, uid, context)
+            seconds = time.time() - start
+            model_stats = {'model': model,
+                           'done': done,
+                           'failed': failed,
+                           'seconds': seconds,
+                           'rate': done / seconds if seconds else 0.,
+                           }
+            _logger.info('bootstrap of %(model)s finished: %(done)d '
+                         'records in %(seconds).1fs (%(rate).1f/s), '
+                         '%(failed)d failed', model_stats)
+            stats.append(model_stats)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return stats
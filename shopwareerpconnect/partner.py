@@ -167,10 +167,12 @@ class ShopwareAddress(models.Model):
 class PartnerAdapter(GenericAdapter):
     _model_name = 'shopware.res.partner'
     _shopware_model = 'customers'
+    _read_ttl = 2
 
-    def _call(self, method, arguments):
+    def _call(self, method, arguments, **kwargs):
         try:
-            return super(PartnerAdapter, self)._call(method, arguments)
+            return super(PartnerAdapter, self)._call(method, arguments,
+                                                       **kwargs)
         except xmlrpclib.Fault as err:
             # this is the error in the Shopware API
             # when the customer does not exist
@@ -180,7 +182,7 @@ class PartnerAdapter(GenericAdapter):
                 raise
 
     def search(self, filters=None, from_date=None, to_date=None,
-               shopware_shop_ids=None):
+               shopware_shop_ids=None, page_size=None, stream=False):
         """ Search records according to some criteria and return a
         list of ids
 
@@ -215,7 +217,9 @@ class PartnerAdapter(GenericAdapter):
 
                 index += 1
 
-        return super(PartnerAdapter, self).search(filters)
+        return super(PartnerAdapter, self).search(filters,
+                                                  page_size=page_size,
+                                                  stream=stream)
 
 
 @shopware
@@ -231,15 +235,14 @@ class PartnerBatchImporter(DelayedBatchImporter):
         from_date = filters.pop('from_date', None)
         to_date = filters.pop('to_date', None)
         shopware_shop_ids = [filters.pop('shopware_shop_id')]
-        record_ids = self.backend_adapter.search(
-            filters,
-            from_date=from_date,
-            to_date=to_date,
-            shopware_shop_ids=shopware_shop_ids)
-        _logger.info('search for shopware partners %s returned %s',
-                     filters, record_ids)
-        for record_id in record_ids:
-            self._import_record(record_id)
+        pages = self._search(filters,
+                             from_date=from_date,
+                             to_date=to_date,
+                             shopware_shop_ids=shopware_shop_ids)
+        for record_ids in pages:
+            _logger.info('search for shopware partners %s returned %s',
+                         filters, record_ids)
+            self._import_page(record_ids)
 
 
 PartnerBatchImport = PartnerBatchImporter  # deprecated
@@ -346,6 +349,10 @@ class PartnerImporter(ShopwareImporter):
 
     _base_mapper = PartnerImportMapper
 
+    def _dependencies(self, record):
+        return [('shopware.res.partner.category', record['group_id'],
+                 False)]
+
     def _import_dependencies(self):
         """ Import the dependencies for the record"""
         record = self.shopware_record
@@ -409,8 +416,10 @@ class PartnerAddressBook(ConnectorUnit):
                                           {'eq': shopware_partner_id}})
         if not mag_address_ids:
             return
-        for address_id in mag_address_ids:
-            shopware_record = adapter.read(address_id)
+        for address_id, shopware_record, error in adapter.read_many(
+                mag_address_ids):
+            if error is not None:
+                raise error
 
             # defines if the billing address is merged with the partner
             # or imported as a standalone contact
@@ -556,6 +565,8 @@ class CompanyImportMapper(BaseAddressImportMapper):
 class AddressAdapter(GenericAdapter):
     _model_name = 'shopware.address'
     _shopware_model = 'addresses'
+    _read_ttl = 2
+    _read_many_list = True
 
     def search(self, filters=None):
         """ Search records according to some criterias
@@ -57,6 +57,7 @@ class ShopwareResPartnerCategory(models.Model):
 class PartnerCategoryAdapter(GenericAdapter):
     _model_name = 'shopware.res.partner.category'
     _shopware_model = 'CustomerGroups'
+    _cache_ttl = 3600
 
 
 @shopware
@@ -78,6 +79,8 @@ class PartnerCategoryImportMapper(ImportMapper):
         # ('tax_class_id', 'tax_class_id'),
     ]
 
+    _source_fields = ('id', 'key')
+
     @mapping
     def shopware_id(self, record):
         return {'shopware_id': record['id']}
@@ -20,6 +20,7 @@
 #
 ##############################################################################
 
+import hashlib
 import logging
 import urllib2
 import base64
@@ -30,6 +31,7 @@ from collections import defaultdict
 from openerp import models, fields, api, _
 from openerp.addons.connector.queue.job import job, related_action
 from openerp.addons.connector.event import on_record_write
+from openerp.addons.connector.session import ConnectorSession
 from openerp.addons.connector.unit.synchronizer import (Importer,
                                                         Exporter,
                                                         )
@@ -48,7 +50,6 @@ from .unit.import_synchronizer import (DelayedBatchImporter,
                                        ShopwareImporter,
                                        TranslationImporter,
                                        AddCheckpoint,
-                                       import_record
                                        )
 from .connector import get_environment
 from .backend import shopware
@@ -180,20 +181,54 @@ class ShopwareProductProduct(models.Model):
 
         location = backend.warehouse_id.lot_stock_id
 
-        product_fields = ['shopware_qty', stock_field]
+        product_fields = ['shopware_qty', 'no_stock_sync', stock_field]
         if read_fields:
             product_fields += read_fields
 
+        bulk = backend.bulk_inventory_export
         self_with_location = self.with_context(location=location.id)
         for chunk_ids in chunks(products.ids, self.RECOMPUTE_QTY_STEP):
             records = self_with_location.browse(chunk_ids)
+            changed = defaultdict(list)
             for product in records.read(fields=product_fields):
                 new_qty = self._shopware_qty(product,
                                             backend,
                                             location,
                                             stock_field)
                 if new_qty != product['shopware_qty']:
-                    self.browse(product['id']).shopware_qty = new_qty
+                    if bulk:
+                        changed[new_qty].append(product['id'])
+                    else:
+                        self.browse(product['id']).shopware_qty = new_qty
+            if changed:
+                self._export_shopware_qty_bulk(backend, changed)
+
+    @api.model
+    def _export_shopware_qty_bulk(self, backend, changed):
+        """ Write the new quantities and delay their export in chunks.
+
+        The write does not trigger one export job per product, the
+        products are exported in chunks with the batch mode of
+        the Shopware API instead.
+
+        :param changed: dict with the new quantities as keys and the
+                        list of the products ids as values
+        """
+        to_export = []
+        for qty, product_ids in changed.iteritems():
+            products = self.browse(product_ids)
+            products.with_context(connector_no_export=True).write(
+                {'shopware_qty': qty})
+            to_export += [product.id for product in products
+                          if not product.no_stock_sync]
+        if not to_export:
+            return
+        session = ConnectorSession.from_env(self.env)
+        chunk_size = backend.inventory_export_chunk_size or len(to_export)
+        for chunk_ids in chunks(to_export, chunk_size):
+            export_product_inventory_batch.delay(
+                session, self._name, backend.id, chunk_ids,
+                fields=['shopware_qty'], priority=20)
 
     @api.multi
     def _shopware_qty(self, product, backend, location, stock_field):
@@ -224,7 +259,11 @@ class ArticleAdapter(GenericAdapter):
     _model_name = 'shopware.article'
     _shopware_model = 'articles'
 
-    def search(self, filters=None, from_date=None, to_date=None):
+    _search_keyset = True
+    _read_ttl = 2
+
+    def search(self, filters=None, from_date=None, to_date=None,
+               page_size=None, stream=False, changed=False):
         """ Search records according to some criteria and return a
         list of ids
 
@@ -253,7 +292,10 @@ class ArticleAdapter(GenericAdapter):
                 'value': to_date.isoformat()
             }
 
-        return super(ArticleAdapter, self).search(filters)
+        return super(ArticleAdapter, self).search(filters,
+                                                  page_size=page_size,
+                                                  stream=stream,
+                                                  changed=changed)
 
 
 
@@ -261,6 +303,7 @@ class ArticleAdapter(GenericAdapter):
 class ProductProductAdapter(GenericAdapter):
     _model_name = 'shopware.product.product'
     _shopware_model = 'variants'
+    _read_ttl = 2
 
     def write(self, id, data, shop_id=None):
         """ Update records on the external system """
@@ -277,22 +320,31 @@ class ProductProductAdapter(GenericAdapter):
     def update_inventory(self, id, data):
         return self._call('%s/%d' % (self._shopware_model, int(id)), data, 'PUT')
 
+    def update_inventory_batch(self, data):
+        """ Update the inventory of several variants in one request.
+
+        :param data: list of values, each one containing the ``id``
+                     of the variant
+        :return: list with the result of the update of each variant
+        """
+        return self._call(self._shopware_model, data, 'PUT')
+
 @shopware
 class ArticleBatchImporter(DelayedBatchImporter):
     """ Import the Shopware Articles.  """
     _model_name = ['shopware.article']
 
+    _skip_uptodate = True
+
     def run(self, filters=None):
         """ Run the synchronization """
         from_date = filters.pop('from_date', None)
         to_date = filters.pop('to_date', None)
-        record_ids = self.backend_adapter.search(filters,
-                                                 from_date=from_date,
-                                                 to_date=to_date)
-        _logger.info('search for shopware products %s returned %s',
-                     filters, record_ids)
-        for record_id in record_ids:
-            self._import_record(record_id)
+        pages = self._search(filters, from_date=from_date, to_date=to_date)
+        for record_ids in pages:
+            _logger.info('search for shopware products %s returned %s',
+                         filters, record_ids)
+            self._import_page(record_ids)
 
 
 @shopware
@@ -434,6 +486,7 @@ class ArticleImportMapper(ImportMapper):
               ('id', 'shopware_id'),
               (normalize_datetime('changed'), 'changed')]
 
+    _source_fields = ('changed', 'categories')
 
     @mapping
     def backend_id(self, record):
@@ -441,18 +494,20 @@ class ArticleImportMapper(ImportMapper):
 
     @mapping
     def categories(self, record):
-        sw_categories = record['categories']
+        sw_category_ids = [sw_category['id']
+                           for sw_category in record['categories']]
         binder = self.binder_for('shopware.product.category')
+        categ_ids = binder.to_openerp_many(sw_category_ids, unwrap=True)
 
         category_ids = []
         main_categ_id = None
 
-        for sw_category in sw_categories:
-            cat_id = binder.to_openerp(sw_category['id'], unwrap=True)
+        for sw_category_id in sw_category_ids:
+            cat_id = categ_ids.get(sw_category_id)
             if cat_id is None:
                 raise MappingError("The product category with "
                                    "shopware id %s is not imported." %
-                                   sw_category['id'])
+                                   sw_category_id)
 
             category_ids.append(cat_id)
 
@@ -486,6 +541,8 @@ class ProductImportMapper(ImportMapper):
               ('weight', 'weight'),
               ('articleId', 'shopware_article_id')]
 
+    _source_fields = ('id', 'prices')
+
     @mapping
     def price(self, record):
         # only import the EK price, because this one always exists
@@ -536,27 +593,43 @@ class ArticleImporter(ShopwareImporter):
     _model_name = ['shopware.article']
 
     _base_mapper = ArticleImportMapper
+    _source_fields = ShopwareImporter._source_fields + (
+        'categories', 'mainDetail', 'details')
+
+    def _dependencies(self, record):
+        return [('shopware.product.category', sw_category['id'], False)
+                for sw_category in record['categories']]
 
     def _import_dependencies(self):
         """ Import the dependencies for the record"""
         record = self.shopware_record
-        for sw_category in record['categories']:
-            self._import_dependency(sw_category['id'],
-                                    'shopware.product.category')
+        self._import_dependency_many(
+            [sw_category['id'] for sw_category in record['categories']],
+            'shopware.product.category')
 
     def _after_import(self, binding):
         """ Hook called at the end of the import """
+        # the bootstrap of the catalog imports all the details afterwards
+        if self.session.context.get('shopware_bootstrap'):
+            return
 
         record = self.shopware_record
         product_model = 'shopware.product.product'
 
-        # import the main detail directly
-        sw_main_detail_id = record['mainDetail']['id']
-        import_record(self.session, product_model, self.backend_record.id, sw_main_detail_id)
-
-        # import remaining details directly
-        for sw_detail in record['details']:
-            import_record(self.session, product_model, self.backend_record.id, sw_detail['id'])
+        # import the main detail, then the remaining details, directly;
+        # their records are read at once
+        detail_ids = [record['mainDetail']['id']]
+        detail_ids += [sw_detail['id'] for sw_detail in record['details']
+                       if sw_detail['id'] != detail_ids[0]]
+        importer = self.unit_for(ShopwareImporter, model=product_model)
+        results = importer.backend_adapter.read_many(
+            detail_ids, attributes=importer._read_fields())
+        for detail_id, detail_record, error in results:
+            importer = self.unit_for(ShopwareImporter, model=product_model)
+            # a failed read is done again by the import, which handles
+            # the missing records
+            importer.run(detail_id,
+                         record=detail_record if error is None else None)
 
 
 @shopware
@@ -564,6 +637,10 @@ class ProductImporter(ShopwareImporter):
     _model_name = ['shopware.product.product']
 
     _base_mapper = ProductImportMapper
+    _source_fields = ShopwareImporter._source_fields + ('articleId',)
+
+    def _dependencies(self, record):
+        return [('shopware.article', record['articleId'], False)]
 
     def _import_dependencies(self):
         """ Import the dependencies for the record"""
@@ -571,6 +648,17 @@ class ProductImporter(ShopwareImporter):
         # import related article
         self._import_dependency(record['articleId'], 'shopware.article')
 
+    def _fingerprint(self):
+        """ The mapper copies values of the article on the product, so
+        the fingerprint includes the one of the article: the variants
+        are imported again when only their article changed """
+        fingerprint = super(ProductImporter, self)._fingerprint()
+        binder = self.binder_for('shopware.article')
+        article = binder.to_openerp(self.shopware_record['articleId'],
+                                    browse=True)
+        article_hash = article.shopware_hash if article else ''
+        return hashlib.sha1(fingerprint + (article_hash or '')).hexdigest()
+
     def _create(self, data):
         openerp_binding = super(ProductImporter, self)._create(data)
         checkpoint = self.unit_for(AddCheckpoint)
@@ -648,6 +736,54 @@ class ProductInventoryExporter(Exporter):
 ProductInventoryExport = ProductInventoryExporter  # deprecated
 
 
+@shopware
+class ProductInventoryBatchExporter(Exporter):
+    """ Export the inventory of several products in one request, using
+    the batch mode of the Shopware API.
+
+    The products which fail to be updated are exported again with
+    one job per product.
+    """
+    _model_name = ['shopware.product.product']
+
+    def run(self, binding_ids, fields):
+        """ Export the inventory of the products to Shopware """
+        inventory_exporter = self.unit_for(ProductInventoryExporter)
+        shopware_ids = self.binder.to_backend_many(binding_ids)
+        products = []
+        data = []
+        for product in self.model.browse(binding_ids).exists():
+            shopware_id = shopware_ids.get(product.id)
+            if not shopware_id:
+                continue
+            values = inventory_exporter._get_data(product, fields)
+            values['id'] = int(shopware_id)
+            products.append(product)
+            data.append(values)
+        if not data:
+            return _('Nothing to export.')
+        results = self.backend_adapter.update_inventory_batch(data)
+        if not isinstance(results, list):
+            results = []
+        failed = []
+        for index, product in enumerate(products):
+            result = results[index] if index < len(results) else {}
+            if not result.get('success'):
+                _logger.info('inventory of the product %s not updated: %s',
+                             product.id, result.get('message'))
+                failed.append(product.id)
+                export_product_inventory.delay(self.session,
+                                               self.model._name,
+                                               product.id,
+                                               fields=fields,
+                                               priority=20)
+        if failed:
+            return _('Inventory of %d products exported, %d failed and '
+                     'will be retried separately.') % (
+                len(products) - len(failed), len(failed))
+        return _('Inventory of %d products exported.') % len(products)
+
+
 # fields which should not trigger an export of the products
 # but an export of their inventory
 INVENTORY_FIELDS = ('manage_stock',
@@ -678,3 +814,12 @@ def export_product_inventory(session, model_name, record_id, fields=None):
     env = get_environment(session, model_name, backend_id)
     inventory_exporter = env.get_connector_unit(ProductInventoryExporter)
     return inventory_exporter.run(record_id, fields)
+
+
+@job(default_channel='root.shopware')
+def export_product_inventory_batch(session, model_name, backend_id,
+                                   binding_ids, fields=None):
+    """ Export the inventory of a chunk of products in one request. """
+    env = get_environment(session, model_name, backend_id)
+    inventory_exporter = env.get_connector_unit(ProductInventoryBatchExporter)
+    return inventory_exporter.run(binding_ids, fields)
@@ -76,8 +76,10 @@ class ProductCategory(models.Model):
 class ProductCategoryAdapter(GenericAdapter):
     _model_name = 'shopware.product.category'
     _shopware_model = 'categories'
+    _cache_ttl = 300
 
-    def search(self, filters=None, from_date=None, to_date=None):
+    def search(self, filters=None, from_date=None, to_date=None,
+               page_size=None, stream=False, changed=False):
         """ Search records according to some criteria and return a
         list of ids
 
@@ -106,7 +108,9 @@ class ProductCategoryAdapter(GenericAdapter):
                 'value': to_date.isoformat()
             }
 
-        return super(ProductCategoryAdapter, self).search(filters)
+        return super(ProductCategoryAdapter, self).search(
+            filters, page_size=page_size,
+            stream=stream, changed=changed)
 
 
     def move(self, categ_id, parent_id, after_categ_id=None):
@@ -134,12 +138,17 @@ class ProductCategoryAdapter(GenericAdapter):
 class ProductCategoryBatchImporter(DelayedBatchImporter):
     """ Import the Shopware Product Categories.
 
-    For every product category in the list, a delayed job is created.
-    A priority is set on the jobs according to their level to rise the
-    chance to have the top level categories imported first.
+    For every product category in the list, a delayed job is created,
+    or a job per chunk of categories when an import chunk size is
+    configured on the backend.  A priority is set on the jobs according
+    to their ids to rise the chance to have the top level categories
+    imported first.  The job of a chunk imports the missing parents of
+    its categories first in any case (see ``ImportPlanner``).
     """
     _model_name = ['shopware.product.category']
 
+    _skip_uptodate = True
+
     def _import_record(self, shopware_id, priority=None):
         """ Delay a job for the import """
         super(ProductCategoryBatchImporter, self)._import_record(
@@ -149,17 +158,25 @@ class ProductCategoryBatchImporter(DelayedBatchImporter):
         """ Run the synchronization """
         from_date = filters.pop('from_date', None)
         to_date = filters.pop('to_date', None)
-        if from_date or to_date:
-            updated_ids = self.backend_adapter.search(filters,
-                                                      from_date=from_date,
-                                                      to_date=to_date)
-        else:
-            updated_ids = None
-
+        for record_ids in self._search(filters, from_date=from_date,
+                                       to_date=to_date):
+            self._import_page(record_ids)
+
+    def _import_page(self, record_ids):
+        if self.backend_record.import_chunk_size:
+            super(ProductCategoryBatchImporter, self)._import_page(
+                sorted(record_ids))
+            return
         base_priority = 10
-
-        for record_id in updated_ids:
+        for record_id in record_ids:
             self._import_record(record_id, priority=base_priority+record_id)
+        self.session.commit()
+
+    def _import_chunk(self, record_ids, **kwargs):
+        """ Delay a job for a chunk, prioritized by its first id """
+        kwargs.setdefault('priority', 10 + record_ids[0])
+        super(ProductCategoryBatchImporter, self)._import_chunk(
+            record_ids, **kwargs)
 
 ProductCategoryBatchImport = ProductCategoryBatchImporter  # deprecated
 
@@ -168,6 +185,10 @@ ProductCategoryBatchImport = ProductCategoryBatchImporter  # deprecated
 class ProductCategoryImporter(ShopwareImporter):
     _model_name = ['shopware.product.category']
 
+    def _dependencies(self, record):
+        return [('shopware.product.category', record.get('parentId'),
+                 False)]
+
     def _import_dependencies(self):
         """ Import the dependencies for the record"""
         record = self.shopware_record
@@ -177,7 +198,8 @@ class ProductCategoryImporter(ShopwareImporter):
             parent_id = record['parentId']
             if self.binder.to_openerp(parent_id) is None:
                 importer = self.unit_for(ShopwareImporter)
-                importer.run(parent_id)
+                importer.run(parent_id, record=self._prefetched_record(
+                    'shopware.product.category', parent_id))
 
     def _create(self, data):
         openerp_binding = super(ProductCategoryImporter, self)._create(data)
@@ -198,6 +220,8 @@ ProductCategoryImport = ProductCategoryImporter  # deprecated
 class ProductCategoryImportMapper(ImportMapper):
     _model_name = 'shopware.product.category'
 
+    _source_fields = ('id', 'name', 'parentId')
+
     @mapping
     def name(self, record):
         if not record.get('parentId'):  # top level category in Shopware is named "Root", better take the backend name
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Recorder of the calls to the Shopware API, safe to leave running on a
+production worker.
+
+The calls are kept in a ring buffer bounded by bytes: when it is full,
+the oldest calls are dropped.  Only a sample of the calls can be
+recorded, and only the ones of some resources.  The adapters hand the
+raw body of the responses over to a thread which decodes them and
+serializes the calls, so a recorded call costs little more than a
+queued item to the synchronization.  The calls waiting for the thread
+are bounded by bytes as well.
+
+The recorder is per worker process.  ``output_recorder`` writes its
+buffer in a cassette: a file with one JSON object per call, which can
+be replayed by the Shopware stand-in server (``benchmark/stand_in.py``).
+"""
+
+import json
+import logging
+import random
+import threading
+from collections import deque
+from Queue import Queue, Full
+
+_logger = logging.getLogger(__name__)
+
+# bytes of serialized calls kept by default
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# calls waiting to be serialized, beyond this or beyond ``max_bytes``
+# of waiting bodies the new calls are dropped rather than slowing down
+# the synchronization
+QUEUE_SIZE = 1000
+
+
+class Recorder(object):
+    """ Ring buffer of the serialized calls, bounded by bytes """
+
+    def __init__(self):
+        self.active = False
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self.sample_rate = 1.
+        self.resources = ()
+        self.recorded = 0
+        self.dropped = 0
+        self._lines = deque()
+        self._bytes = 0
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._queue = Queue(QUEUE_SIZE)
+        self._thread = None
+
+    def start(self, max_bytes=None, sample_rate=1., resources=None):
+        """ Start to record, the calls recorded before are cleared
+
+        :param max_bytes: size of the buffer
+        :param sample_rate: ratio of the calls recorded, between 0 and 1
+        :param resources: prefixes of the resources to record
+                          (``articles``, ``orders``, ...), all if empty
+        """
+        with self._lock:
+            self._lines.clear()
+            self._bytes = 0
+            self.recorded = self.dropped = 0
+            self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+            self.sample_rate = sample_rate
+            self.resources = tuple(resources or ())
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._serialize,
+                    name='shopware.recorder')
+                self._thread.daemon = True
+                self._thread.start()
+            self.active = True
+        _logger.info('recording the calls to Shopware: %d bytes, '
+                     'sample rate %s, resources %s', self.max_bytes,
+                     self.sample_rate, ', '.join(self.resources) or 'all')
+
+    def stop(self):
+        """ Stop to record, the buffer is kept until the next start """
+        self.active = False
+
+    def wants(self, resource):
+        """ Whether a call to ``resource`` is recorded, checked before
+        anything is prepared for the recorder """
+        if not self.active:
+            return False
+        if self.resources and not resource.startswith(self.resources):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def add(self, resource, method, arguments, body=None, result=None,
+            size=None):
+        """ Queue a call to be serialized by the thread of the recorder
+
+        The arguments are serialized right away as the callers may
+        change them afterwards.  The response is given either as its
+        raw ``body``, or as a ``result`` which will not change, whose
+        ``size`` in bytes is given by the caller.
+        """
+        try:
+            arguments = json.dumps(arguments, separators=(',', ':'),
+                                   default=unicode)
+        except (TypeError, ValueError):
+            self.dropped += 1
+            return
+        size = len(arguments) + (size or len(body or ''))
+        with self._lock:
+            if self._pending_bytes + size > self.max_bytes:
+                self.dropped += 1
+                return
+            self._pending_bytes += size
+        try:
+            self._queue.put_nowait((size, (resource, method, arguments,
+                                           body, result)))
+        except Full:
+            self._release(size)
+            self.dropped += 1
+
+    def _release(self, size):
+        with self._lock:
+            self._pending_bytes -= size
+
+    def _serialize(self):
+        while True:
+            size, call = self._queue.get()
+            try:
+                self._append(self._line(*call))
+            except Exception:
+                self.dropped += 1
+                _logger.exception('could not record a call to Shopware')
+            finally:
+                # the body is released with the call
+                call = None
+                self._release(size)
+                self._queue.task_done()
+
+    @staticmethod
+    def _line(resource, method, arguments, body, result):
+        if body is not None:
+            result = json.loads(body) if body else True
+            # the Shopware API wraps the records in a 'data' envelope
+            if isinstance(result, dict) and 'data' in result:
+                result = result['data']
+        return ('{"resource":%s,"method":%s,"arguments":%s,"result":%s}\n'
+                % (json.dumps(resource), json.dumps(method), arguments,
+                   json.dumps(result, separators=(',', ':'),
+                              default=unicode)))
+
+    def _append(self, line):
+        with self._lock:
+            self._lines.append(line)
+            self._bytes += len(line)
+            self.recorded += 1
+            while self._bytes > self.max_bytes and len(self._lines) > 1:
+                self._bytes -= len(self._lines.popleft())
+
+    def output(self, filename):
+        """ Write the calls of the buffer in a cassette """
+        # wait for the calls being serialized
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+        with self._lock:
+            lines = list(self._lines)
+        with open(filename, 'w') as f:
+            f.writelines(lines)
+        _logger.debug('recorder written to file %s: %d calls, %d calls '
+                      'dropped', filename, len(lines), self.dropped)
+        return len(lines)
+
+
+recorder = Recorder()
+
+
+def start_recorder(max_bytes=None, sample_rate=1., resources=None):
+    recorder.start(max_bytes=max_bytes, sample_rate=sample_rate,
+                   resources=resources)
+
+
+def stop_recorder():
+    recorder.stop()
+
+
+def output_recorder(filename):
+    """ Write the recorded calls in a cassette """
+    return recorder.output(filename)
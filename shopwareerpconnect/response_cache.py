@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Cache of the responses of the Shopware API for the resources which
+almost never change (shops, customer groups, categories).
+
+The adapters having a ``_cache_ttl`` keep the records they read in a
+LRU cache of the worker process and, when the backend uses the shared
+cache, in the ``shopware_response_cache`` table read by all the workers.
+
+Clearing the cache of a backend increments its generation, which is part
+of the keys, so the entries kept in memory by the other workers are no
+longer used.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+from openerp import models, fields
+
+from .api_state import autocommit_cursor
+
+_logger = logging.getLogger(__name__)
+
+# probability to delete the expired rows of the shared cache when
+# a response is stored
+SWEEP_PROBABILITY = 0.01
+
+
+class ShopwareResponseCache(models.Model):
+    _name = 'shopware.response.cache'
+    _description = 'Shopware Response Cache'
+    _rec_name = 'resource'
+
+    backend_id = fields.Many2one(
+        comodel_name='shopware.backend',
+        string='Shopware Backend',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+    )
+    key = fields.Char(required=True, readonly=True, index=True)
+    resource = fields.Char(readonly=True)
+    value = fields.Text(readonly=True)
+    expires = fields.Float(readonly=True)
+
+    _sql_constraints = [
+        ('backend_key_uniq', 'unique(backend_id, key)',
+         'A response can be cached only once.'),
+    ]
+
+
+class LRUCache(object):
+    """ Size-bounded cache, the entries expire after their TTL """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Return ``(True, value)`` for a hit, ``(False, None)`` else """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                return False, None
+            # move it at the end, as most recently used
+            self._entries[key] = entry
+            return True, entry[1]
+
+    def put(self, key, value, expires):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self, predicate=None):
+        """ Remove the entries whose key matches ``predicate``,
+        all of them without predicate """
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+
+memory_cache = LRUCache()
+
+
+def _db_key(generation, resource, arguments):
+    payload = json.dumps([generation, resource, arguments],
+                         sort_keys=True, default=unicode)
+    return hashlib.sha1(payload).hexdigest()
+
+
+def cache_get(backend, dbname, resource, arguments, freeze):
+    """ Look for a response in the memory and the shared caches
+
+    :param freeze: function returning a hashable key for the resource
+                   and arguments
+    :return: ``(True, response)`` for a hit, ``(False, None)`` else
+    """
+    generation = backend.response_cache_generation
+    key = (dbname, backend.id, generation, freeze(resource, arguments))
+    memory_cache.size = backend.response_cache_size or memory_cache.size
+    hit, value = memory_cache.get(key)
+    if hit:
+        return True, copy.deepcopy(value)
+    if not backend.response_cache_shared:
+        return False, None
+    with autocommit_cursor(dbname) as cr:
+        cr.execute("SELECT value, expires FROM shopware_response_cache "
+                   "WHERE backend_id = %s AND key = %s "
+                   "AND expires > extract(epoch from clock_timestamp())",
+                   (backend.id, _db_key(generation, resource, arguments)))
+        row = cr.fetchone()
+    if row is None:
+        return False, None
+    value = json.loads(row[0])
+    memory_cache.put(key, value, row[1])
+    return True, copy.deepcopy(value)
+
+
+def cache_put(backend, dbname, resource, arguments, value, ttl, freeze):
+    """ Store a response in the memory and the shared caches """
+    generation = backend.response_cache_generation
+    key = (dbname, backend.id, generation, freeze(resource, arguments))
+    memory_cache.put(key, copy.deepcopy(value), time.time() + ttl)
+    if not backend.response_cache_shared:
+        return
+    db_key = _db_key(generation, resource, arguments)
+    params = {'backend_id': backend.id,
+              'key': db_key,
+              'resource': resource,
+              'value': json.dumps(value, default=unicode),
+              'ttl': ttl}
+    with autocommit_cursor(dbname) as cr:
+        cr.execute("UPDATE shopware_response_cache "
+                   "SET value = %(value)s, "
+                   "    expires = extract(epoch from clock_timestamp()) "
+                   "              + %(ttl)s "
+                   "WHERE backend_id = %(backend_id)s AND key = %(key)s",
+                   params)
+        if not cr.rowcount:
+            try:
+                cr.execute("INSERT INTO shopware_response_cache "
+                           "(backend_id, key, resource, value, expires) "
+                           "VALUES (%(backend_id)s, %(key)s, %(resource)s, "
+                           "        %(value)s, "
+                           "        extract(epoch from clock_timestamp()) "
+                           "        + %(ttl)s)",
+                           params)
+            except psycopg2.IntegrityError:
+                # stored meanwhile by another worker, or the backend is
+                # not committed yet
+                pass
+        if random.random() < SWEEP_PROBABILITY:
+            cr.execute("DELETE FROM shopware_response_cache "
+                       "WHERE expires < extract(epoch from clock_timestamp())")
+
+
+def cache_clear(dbname, backend_id):
+    """ Remove the responses of a backend from the caches of the current
+    process and of the database """
+    memory_cache.clear(lambda key: key[:2] == (dbname, backend_id))
+    with autocommit_cursor(dbname) as cr:
+        cr.execute("DELETE FROM shopware_response_cache "
+                   "WHERE backend_id = %s", (backend_id,))
+    _logger.info('cleared the cache of the Shopware responses of the '
+                 'backend %s', backend_id)
@@ -41,6 +41,7 @@ from openerp.addons.connector_ecommerce.sale import (ShippingLineBuilder,
                                                      GiftOrderLineBuilder)
 from .unit.backend_adapter import (GenericAdapter,
                                    MAGENTO_DATETIME_FORMAT,
+                                   project,
                                    )
 from .unit.import_synchronizer import (DelayedBatchImporter,
                                        ShopwareImporter,
@@ -268,9 +269,10 @@ class SaleOrderAdapter(GenericAdapter):
     _model_name = 'shopware.sale.order'
     _shopware_model = 'orders'
 
-    def _call(self, method, arguments):
+    def _call(self, method, arguments, **kwargs):
         try:
-            return super(SaleOrderAdapter, self)._call(method, arguments)
+            return super(SaleOrderAdapter, self)._call(method, arguments,
+                                                         **kwargs)
         except xmlrpclib.Fault as err:
             # this is the error in the Shopware API
             # when the sales order does not exist
@@ -280,7 +282,7 @@ class SaleOrderAdapter(GenericAdapter):
                 raise
 
     def search(self, filters=None, from_date=None, to_date=None,
-               shopware_shop_ids=None):
+               shopware_shop_ids=None, page_size=None, stream=False):
         """ Search records according to some criteria
         and returns a list of ids
 
@@ -302,16 +304,20 @@ class SaleOrderAdapter(GenericAdapter):
                      # 'limit': 200,
                      'filters': filters,
                      }
-        return super(SaleOrderAdapter, self).search(arguments)
+        return super(SaleOrderAdapter, self).search(arguments,
+                                                    page_size=page_size,
+                                                    stream=stream)
 
     def read(self, id, attributes=None):
         """ Returns the information of a record
 
         :rtype: dict
         """
-        record = self._call('%s.info' % self._shopware_model,
-                            [id, attributes])
-        return record
+        resource = '%s.info' % self._shopware_model
+        record = self._single_flight(
+            resource, [id, attributes],
+            lambda: self._call(resource, [id, attributes]))
+        return project(record, attributes)
 
     def get_parent(self, id):
         return self._call('%s.get_parent' % self._shopware_model, [id])
@@ -330,6 +336,12 @@ class SaleOrderBatchImport(DelayedBatchImporter):
         return super(SaleOrderBatchImport, self)._import_record(
             record_id, max_retries=0, priority=5)
 
+    def _import_chunk(self, record_ids, **kwargs):
+        """ Delay the import of a chunk of records """
+        return super(SaleOrderBatchImport, self)._import_chunk(
+            record_ids, priority=5,
+            job_options={'max_retries': 0, 'priority': 5})
+
     def run(self, filters=None):
         """ Run the synchronization """
         if filters is None:
@@ -338,15 +350,14 @@ class SaleOrderBatchImport(DelayedBatchImporter):
         from_date = filters.pop('from_date', None)
         to_date = filters.pop('to_date', None)
         shopware_shop_ids = [filters.pop('shopware_shop_id')]
-        record_ids = self.backend_adapter.search(
-            filters,
-            from_date=from_date,
-            to_date=to_date,
-            shopware_shop_ids=shopware_shop_ids)
-        _logger.info('search for shopware saleorders %s returned %s',
-                     filters, record_ids)
-        for record_id in record_ids:
-            self._import_record(record_id)
+        pages = self._search(filters,
+                             from_date=from_date,
+                             to_date=to_date,
+                             shopware_shop_ids=shopware_shop_ids)
+        for record_ids in pages:
+            _logger.info('search for shopware saleorders %s returned %s',
+                         filters, record_ids)
+            self._import_page(record_ids)
 
 
 @shopware
@@ -851,7 +862,9 @@ class SaleOrderImporter(ShopwareImporter):
             # we always update the customer when importing an order
             importer = self.unit_for(ShopwareImporter,
                                      model='shopware.res.partner')
-            importer.run(record['customer_id'])
+            importer.run(record['customer_id'],
+                         record=self._prefetched_record(
+                             'shopware.res.partner', record['customer_id']))
             partner_binding = partner_binder.to_openerp(record['customer_id'],
                                                         browse=True)
 
@@ -918,6 +931,7 @@ class SaleOrderImporter(ShopwareImporter):
             partner_invoice_id=self.partner_invoice_id,
             partner_shipping_id=self.partner_shipping_id,
             shop=shop,
+            line_products=self._line_products(map_record.source),
             **kwargs)
 
     def _update_data(self, map_record, **kwargs):
@@ -930,18 +944,43 @@ class SaleOrderImporter(ShopwareImporter):
             partner_invoice_id=self.partner_invoice_id,
             partner_shipping_id=self.partner_shipping_id,
             shop=shop,
+            line_products=self._line_products(map_record.source),
             **kwargs)
 
+    def _dependencies(self, record):
+        dependencies = [('shopware.product.product', product_id, False)
+                        for product_id in self._get_line_product_ids(record)]
+        is_guest_order = bool(int(record.get('customer_is_guest', 0) or 0))
+        if is_guest_order or not record.get('customer_id'):
+            # the guest customers are created from the order, a
+            # customer without id may be found by its email
+            dependencies.append(('shopware.res.partner.category',
+                                 record.get('customer_group_id'), False))
+        else:
+            # the customer is always updated
+            dependencies.append(('shopware.res.partner',
+                                 record['customer_id'], True))
+        return dependencies
+
     def _import_dependencies(self):
         record = self.shopware_record
 
         self._import_addresses()
 
-        for line in record.get('items', []):
-            _logger.debug('line: %s', line)
-            if 'product_id' in line:
-                self._import_dependency(line['product_id'],
-                                        'shopware.product.product')
+        self._import_dependency_many(self._get_line_product_ids(record),
+                                     'shopware.product.product')
+
+    def _get_line_product_ids(self, record):
+        """ Return the Shopware ids of the products of the lines """
+        return [line['product_id'] for line in record.get('items', [])
+                if 'product_id' in line]
+
+    def _line_products(self, record):
+        """ Return the OpenERP products of the lines, as a dict
+        with the Shopware ids as keys, searched in one query """
+        binder = self.binder_for('shopware.product.product')
+        return binder.to_openerp_many(self._get_line_product_ids(record),
+                                      unwrap=True)
 
 
 SaleOrderImport = SaleOrderImporter  # deprecated
@@ -995,8 +1034,14 @@ class SaleOrderLineImportMapper(ImportMapper):
 
     @mapping
     def product_id(self, record):
-        binder = self.binder_for('shopware.product.product')
-        product_id = binder.to_openerp(record['product_id'], unwrap=True)
+        # the products of all the lines are usually searched at once
+        # by the sale order importer
+        line_products = self.options.line_products
+        if line_products and record['product_id'] in line_products:
+            product_id = line_products[record['product_id']]
+        else:
+            binder = self.binder_for('shopware.product.product')
+            product_id = binder.to_openerp(record['product_id'], unwrap=True)
         assert product_id is not None, (
             "product_id %s should have been imported in "
             "SaleOrderImporter._import_dependencies" % record['product_id'])
@@ -1096,7 +1141,8 @@ class StateExporter(Exporter):
         if not shopware_id:
             return _('Sale is not linked with a Shopware sales order')
         shopware_state = ORDER_STATUS_MAPPING[state]
-        record = self.backend_adapter.read(shopware_id)
+        record = self.backend_adapter.read(shopware_id,
+                                           attributes=['status'])
         if record['status'] == shopware_state:
             return _('Shopware sales order is already '
                      'in state %s') % shopware_state
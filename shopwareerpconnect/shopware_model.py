@@ -21,14 +21,16 @@
 ##############################################################################
 
 import logging
+from cgi import escape
 from datetime import datetime, timedelta
 from openerp import models, fields, api, _
 from openerp.exceptions import Warning as UserError
 from openerp.addons.connector.session import ConnectorSession
 from openerp.addons.connector.connector import ConnectorUnit
 from openerp.addons.connector.unit.mapper import mapping, ImportMapper
-from .unit.backend_adapter import GenericAdapter
+from .unit.backend_adapter import GenericAdapter, invalidate_session_pool
 from .unit.import_synchronizer import (import_batch,
+                                       import_record,
                                        DirectBatchImporter,
                                        ShopwareImporter,
                                        )
@@ -36,11 +38,23 @@ from .partner import partner_import_batch
 from .sale import sale_order_import_batch
 from .backend import shopware
 from .connector import add_checkpoint
+from .bootstrap import bootstrap_catalog, bootstrap_catalog_job
+from .parallel import import_parallel
+from .metrics import reset_metrics, summary as metrics_summary
+from .response_cache import cache_clear
 
 _logger = logging.getLogger(__name__)
 
 IMPORT_DELTA_BUFFER = 30  # seconds
 
+# events sent by Shopware: (model imported, priority of the job)
+WEBHOOK_EVENTS = {
+    'order.placed': ('shopware.sale.order', 1),
+    'order.changed': ('shopware.sale.order', 1),
+    'customer.changed': ('shopware.res.partner', 5),
+    'article.changed': ('shopware.article', 10),
+}
+
 
 class ShopwareBackend(models.Model):
     _name = 'shopware.backend'
@@ -81,6 +95,108 @@ class ShopwareBackend(models.Model):
         string='API key',
         help="Webservice API key",
     )
+    connection_pool_size = fields.Integer(
+        string='Connection Pool Size',
+        default=4,
+        help="Number of idle connections to Shopware kept open "
+             "by each worker process.",
+    )
+    connection_idle_timeout = fields.Integer(
+        string='Connection Idle Timeout',
+        default=60,
+        help="Number of seconds after which an unused connection "
+             "to Shopware is closed.",
+    )
+    api_rate_limit = fields.Float(
+        string='Max Requests per Second',
+        help="Maximum number of requests per second sent to Shopware "
+             "by all the workers. The rate is lowered automatically "
+             "when Shopware answers with errors 429 / 503 or slowly, "
+             "and raised again up to this limit. 0 disables the limit.",
+    )
+    api_slow_threshold = fields.Float(
+        string='Slow Response Threshold',
+        help="Number of seconds after which a response of Shopware "
+             "is considered slow and lowers the rate of the requests. "
+             "0 ignores the response times.",
+    )
+    api_current_rate = fields.Float(
+        string='Current Requests per Second',
+        compute='_compute_api_state',
+        help="Rate of the requests currently allowed by the "
+             "adaptive limit.",
+    )
+    circuit_failure_threshold = fields.Integer(
+        string='Circuit Breaker Threshold',
+        default=5,
+        help="Number of consecutive network or gateway errors after "
+             "which the calls to Shopware are stopped and the jobs "
+             "postponed. 0 disables the circuit breaker.",
+    )
+    circuit_cooldown = fields.Integer(
+        string='Circuit Breaker Cooldown',
+        default=60,
+        help="Number of seconds during which the jobs are postponed "
+             "once the circuit breaker is open, before a call checks "
+             "whether Shopware is reachable again.",
+    )
+    circuit_state = fields.Selection(
+        selection=[('closed', 'Closed'),
+                   ('open', 'Open'),
+                   ('half_open', 'Half-Open')],
+        string='Circuit Breaker',
+        compute='_compute_api_state',
+        help="Open when Shopware is considered unreachable.",
+    )
+    api_connect_timeout = fields.Float(
+        string='Connect Timeout',
+        default=5,
+        help="Number of seconds to wait for the connection to Shopware. "
+             "0 waits without limit.",
+    )
+    api_read_timeout = fields.Float(
+        string='Read Timeout',
+        default=60,
+        help="Number of seconds to wait for data from Shopware. "
+             "0 waits without limit.",
+    )
+    api_timeout_ids = fields.One2many(
+        comodel_name='shopware.api.timeout',
+        inverse_name='backend_id',
+        string='Timeouts by Resource',
+        help="Timeouts of the calls to some resources, replacing the "
+             "timeouts of the backend.",
+    )
+    api_retries = fields.Integer(
+        string='Read Retries',
+        default=2,
+        help="Number of times a read failing on a network or gateway "
+             "error is sent again before the job is postponed.",
+    )
+    api_backoff = fields.Float(
+        string='Retry Backoff',
+        default=0.5,
+        help="Base number of seconds to wait before retrying a read, "
+             "doubled at each retry. The wait is randomized.",
+    )
+    response_cache_size = fields.Integer(
+        string='Response Cache Size',
+        default=1000,
+        help="Number of responses of Shopware kept in memory by each "
+             "worker for the resources which almost never change "
+             "(shops, customer groups, categories).",
+    )
+    response_cache_shared = fields.Boolean(
+        string='Shared Response Cache',
+        help="Also keep the cached responses in the database, "
+             "so they are shared by all the workers.",
+    )
+    response_cache_generation = fields.Integer(
+        string='Response Cache Generation',
+        readonly=True,
+        help="Incremented when the cache is cleared, so the responses "
+             "kept by the workers are no longer used.",
+    )
     sale_prefix = fields.Char(
         string='Sale Prefix',
         help="A prefix put before the name of imported sales orders.\n"
@@ -139,6 +255,44 @@ class ShopwareBackend(models.Model):
              "stock inventory updates.\nIf empty, Quantity Available "
              "is used.",
     )
+    search_page_size = fields.Integer(
+        string='Search Page Size',
+        default=1000,
+        help="Number of ids read per request when searching the "
+             "records to import. 0 reads all the ids in one response, "
+             "decoded while it is received.",
+    )
+    import_chunk_size = fields.Integer(
+        string='Import Chunk Size',
+        default=0,
+        help="Number of records imported per job by the batch imports. "
+             "The records of a job are read at once, and their missing "
+             "dependencies are read and imported before them. "
+             "0 creates one job per record.",
+    )
+    bootstrap_processes = fields.Integer(
+        string='Bootstrap Processes',
+        default=1,
+        help="Number of processes importing the catalog during its "
+             "bootstrap. The button runs the bootstrap in a single "
+             "process, by a job which is stopped by the limit_time_real "
+             "and limit_time_cpu of the workers. With more than one "
+             "process, or for a large catalog, run the "
+             "shopwarebootstrap command of the server: its records are "
+             "imported in parallel by processes forked from the command.",
+    )
+    bulk_inventory_export = fields.Boolean(
+        string='Bulk Inventory Export',
+        help="When the stock quantities are updated, export them "
+             "in chunks using the batch mode of the Shopware API "
+             "instead of one job per product.",
+    )
+    inventory_export_chunk_size = fields.Integer(
+        string='Inventory Export Chunk Size',
+        default=100,
+        help="Number of products exported per job and request "
+             "by the bulk inventory export.",
+    )
     product_binding_ids = fields.One2many(
         comodel_name='shopware.product.product',
         inverse_name='backend_id',
@@ -161,11 +315,133 @@ class ShopwareBackend(models.Model):
         'shop view.'
     )
 
+    api_metrics = fields.Html(
+        string='API Metrics',
+        compute='_compute_api_metrics',
+        help="Calls to the Shopware API done by all the worker "
+             "processes, by resource.",
+    )
+    webhook_secret = fields.Char(
+        string='Webhook Secret',
+        copy=False,
+        help="Secret shared with Shopware to sign the events it sends. "
+             "The events are refused when it is empty.",
+    )
+    webhook_url = fields.Char(
+        string='Webhook URL',
+        compute='_compute_webhook_url',
+        help="Address where Shopware sends its events. The requests "
+             "have no session, so the dbfilter of the server must "
+             "select this database for the host of the address.",
+    )
+
     _sql_constraints = [
         ('sale_prefix_uniq', 'unique(sale_prefix)',
          "A backend with the same sale prefix already exists")
     ]
 
+    @api.multi
+    def write(self, vals):
+        result = super(ShopwareBackend, self).write(vals)
+        connection_fields = ('location', 'username', 'token',
+                             'connection_pool_size',
+                             'connection_idle_timeout')
+        if any(field in vals for field in connection_fields):
+            for backend in self:
+                invalidate_session_pool(self.env.cr.dbname, backend.id)
+        return result
+
+    @api.multi
+    def _compute_webhook_url(self):
+        base_url = self.env['ir.config_parameter'].get_param(
+            'web.base.url', default='')
+        for backend in self:
+            backend.webhook_url = '%s/shopware/webhook/%d' % (base_url,
+                                                             backend.id)
+
+    @api.multi
+    def import_webhook_event(self, event, shopware_id):
+        """ Delay the import of the record concerned by an event sent
+        by Shopware
+
+        :param event: name of the event, a key of ``WEBHOOK_EVENTS``
+        :return: False when the event is unknown
+        """
+        self.ensure_one()
+        if event not in WEBHOOK_EVENTS:
+            return False
+        model, priority = WEBHOOK_EVENTS[event]
+        session = ConnectorSession(self.env.cr, self.env.uid,
+                                   context=self.env.context)
+        import_record.delay(session, model, self.id, shopware_id,
+                            priority=priority)
+        _logger.debug('import of %s %s delayed for the event %s',
+                      model, shopware_id, event)
+        return True
+
+    @api.multi
+    def _compute_api_state(self):
+        states = self.env['shopware.api.state'].search(
+            [('backend_id', 'in', self.ids)])
+        states = dict((state.backend_id.id, state) for state in states)
+        for backend in self:
+            state = states.get(backend.id)
+            if state:
+                backend.api_current_rate = state.rate
+                backend.circuit_state = state.circuit_state
+            else:
+                backend.api_current_rate = backend.api_rate_limit
+                backend.circuit_state = 'closed'
+
+    @api.multi
+    def _compute_api_metrics(self):
+        row_template = (u'<tr><td>%s</td><td>%s</td>'
+                        u'<td class="oe_number">%d</td>'
+                        u'<td class="oe_number">%d</td>'
+                        u'<td class="oe_number">%.1f</td>'
+                        u'<td class="oe_number">%.0f</td>'
+                        u'<td class="oe_number">%s</td>'
+                        u'<td class="oe_number">%.1f</td>'
+                        u'<td class="oe_number">%.1f</td>'
+                        u'<td>%s</td></tr>')
+        for backend in self:
+            rows = metrics_summary(self.env.cr.dbname, backend.id)
+            if not rows:
+                backend.api_metrics = u'<p>%s</p>' % _('No calls yet.')
+                continue
+            lines = [u'<table class="oe_list_content"><thead><tr>',
+                     u''.join(u'<th>%s</th>' % title for title in (
+                         _('Resource'), _('Method'), _('Calls'),
+                         _('Retries'), _('Time (s)'), _('Average (ms)'),
+                         _('P95 (ms)'),
+                         _('KB in'), _('KB out'), _('Outcomes'))),
+                     u'</tr></thead><tbody>']
+            for row in rows:
+                outcomes = u', '.join(u'%s: %d' % item for item
+                                      in sorted(row['outcomes'].items()))
+                lines.append(row_template % (
+                    escape(row['resource']), row['method'], row['calls'],
+                    row['retries'], row['seconds'], row['average_ms'],
+                    '%.0f' % row['p95_ms'], row['kb_in'], row['kb_out'],
+                    outcomes))
+            lines.append(u'</tbody></table>')
+            backend.api_metrics = u''.join(lines)
+
+    @api.multi
+    def reset_api_metrics(self):
+        for backend in self:
+            reset_metrics(self.env.cr.dbname, backend.id)
+        return True
+
+    @api.multi
+    def clear_response_cache(self):
+        """ Forget the cached responses of Shopware, the next calls
+        will read the shops, customer groups and categories again """
+        for backend in self:
+            backend.response_cache_generation += 1
+            cache_clear(self.env.cr.dbname, backend.id)
+        return True
+
     @api.multi
     def check_shopware_structure(self):
         """ Used in each data import.
@@ -266,6 +542,55 @@ class ShopwareBackend(models.Model):
                                'import_products_from_date')
         return True
 
+    @api.multi
+    def bootstrap_catalog(self):
+        """ Delay the bootstrap of the catalog in a job, it lasts far
+        longer than the time limits of a request """
+        session = ConnectorSession(self.env.cr, self.env.uid,
+                                   context=self.env.context)
+        for backend in self:
+            if backend.bootstrap_processes > 1:
+                # the processes would be forked from a worker
+                raise UserError(
+                    _('The bootstrap in several processes is run by the '
+                      'shopwarebootstrap command of the server.'))
+            backend.check_shopware_structure()
+            bootstrap_catalog_job.delay(session, 'shopware.backend',
+                                        backend.id)
+        return True
+
+    @api.multi
+    def run_bootstrap_catalog(self, processes=None):
+        """ Import the whole catalog directly, without jobs, see
+        :mod:`~openerp.addons.shopwareerpconnect.bootstrap`
+
+        Run by the job of :meth:`bootstrap_catalog` and by the
+        ``shopwarebootstrap`` command of the server.
+
+        :param processes: number of processes, the one configured on
+                          the backend by default
+        """
+        session = ConnectorSession(self.env.cr, self.env.uid,
+                                   context=self.env.context)
+        for backend in self:
+            backend.check_shopware_structure()
+            backend_processes = processes or backend.bootstrap_processes
+            if backend_processes > 1:
+                # the processes work in their own transactions
+                self.env.cr.commit()
+                results = import_parallel(
+                    self.env.cr.dbname, self.env.uid, backend.id,
+                    processes=backend_processes,
+                    context=self.env.context)
+            else:
+                results = bootstrap_catalog(session, backend.id)
+            for stats in results:
+                _logger.info('bootstrap of %s on backend %s: %d records, '
+                             '%.1f/s, %d failed', stats['model'],
+                             backend.name, stats['done'], stats['rate'],
+                             stats['failed'])
+        return True
+
     @api.multi
     def _domain_for_update_product_stock_qty(self):
         return [
@@ -314,23 +639,81 @@ class ShopwareBackend(models.Model):
     def _scheduler_update_product_stock_qty(self, domain=None):
         self._shopware_backend('update_product_stock_qty', domain=domain)
 
+    @api.multi
+    def start_recorder(self, max_bytes=None, sample_rate=1.,
+                       resources=None):
+        """ Utility method to start the recording of the requests /
+        responses with Shopware in the current process.
+        Should be called with ``erppeek`` for instance.
+
+        The recorder keeps at most ``max_bytes`` of calls, the oldest
+        ones are dropped.  Only the ratio ``sample_rate`` of the calls
+        to the ``resources`` (prefixes such as ``articles``, all if
+        empty) is recorded.
+        """
+        from .recorder import start_recorder
+        start_recorder(max_bytes=max_bytes, sample_rate=sample_rate,
+                       resources=resources)
+        return True
+
+    @api.multi
+    def stop_recorder(self):
+        """ Utility method to stop the recording in the current
+        process, the recorded calls are kept for ``output_recorder`` """
+        from .recorder import stop_recorder
+        stop_recorder()
+        return True
+
     @api.multi
     def output_recorder(self):
         """ Utility method to output a file containing all the recorded
-        requests / responses with Shopware.  Used to generate test data.
+        requests / responses with Shopware.  Used to generate test data
+        and cassettes for the Shopware stand-in server.
         Should be called with ``erppeek`` for instance.
         """
-        from .unit.backend_adapter import output_recorder
+        from .recorder import output_recorder
         import os
         import tempfile
         fmt = '%Y-%m-%d-%H-%M-%S'
         timestamp = datetime.now().strftime(fmt)
-        filename = 'output_%s_%s' % (self.env.cr.dbname, timestamp)
+        filename = 'output_%s_%s.ndjson' % (self.env.cr.dbname, timestamp)
         path = os.path.join(tempfile.gettempdir(), filename)
         output_recorder(path)
         return path
 
 
+class ShopwareApiTimeout(models.Model):
+    _name = 'shopware.api.timeout'
+    _description = 'Shopware API Timeout'
+    _rec_name = 'resource'
+
+    backend_id = fields.Many2one(
+        comodel_name='shopware.backend',
+        string='Shopware Backend',
+        required=True,
+        ondelete='cascade',
+    )
+    resource = fields.Char(
+        required=True,
+        help="Beginning of the resources of the calls, "
+             "e.g. 'articlesSearch' or 'orders/'. The longest matching "
+             "resource is used.",
+    )
+    connect_timeout = fields.Float(
+        string='Connect Timeout',
+        default=5,
+    )
+    read_timeout = fields.Float(
+        string='Read Timeout',
+        default=60,
+    )
+
+    _sql_constraints = [
+        ('backend_resource_uniq', 'unique(backend_id, resource)',
+         'A resource can have only one timeout by backend.'),
+    ]
+
+
 class ShopwareShop(models.Model):
     _name = 'shopware.shop'
     _inherit = ['shopware.binding']
@@ -506,6 +889,7 @@ class ShopwareShop(models.Model):
 class ShopAdapter(GenericAdapter):
     _model_name = 'shopware.shop'
     _shopware_model = 'shops'
+    _cache_ttl = 3600
 
 
 @shopware
@@ -532,6 +916,8 @@ class ShopImportMapper(ImportMapper):
               ('active', 'enabled'),
               ('position', 'sort_order')]
 
+    _source_fields = ()
+
     @mapping
     def name(self, record):
         name = record['name']
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.tests import common
+from openerp.addons.connector.session import ConnectorSession
+
+from ..connector import get_environment
+
+
+class SetUpShopwareBase(common.TransactionCase):
+    """ Base class for the tests working with a Shopware backend """
+
+    def setUp(self):
+        super(SetUpShopwareBase, self).setUp()
+        self.backend = self.env['shopware.backend'].create({
+            'name': 'Shopware',
+            'version': '5.2',
+            'location': 'http://shopware.localhost',
+            'username': 'api',
+            'token': 'secret',
+            'warehouse_id': self.env.ref('stock.warehouse0').id,
+        })
+        self.session = ConnectorSession(self.cr, self.uid)
+
+    def get_connector_env(self, model_name):
+        return get_environment(self.session, model_name, self.backend.id)
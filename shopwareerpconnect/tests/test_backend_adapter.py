@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest2
+
+from ..unit.backend_adapter import project
+
+RECORD = {'id': 1, 'name': 'Shirt', 'active': True}
+
+
+class TestProject(unittest2.TestCase):
+    """ Projection of the records read on the API """
+
+    def test_list(self):
+        self.assertEqual(project(RECORD, ['id', 'name']),
+                         {'id': 1, 'name': 'Shirt'})
+
+    def test_tuple(self):
+        self.assertEqual(project(RECORD, ('name',)), {'name': 'Shirt'})
+
+    def test_missing_key(self):
+        """ A key absent from the record is not added """
+        self.assertEqual(project(RECORD, ['id', 'price']), {'id': 1})
+
+    def test_no_attributes(self):
+        """ Without a list of attributes the record is kept whole """
+        self.assertEqual(project(RECORD, None), RECORD)
+        self.assertEqual(project(RECORD, 'name'), RECORD)
+        self.assertEqual(project(RECORD, 1), RECORD)
+
+    def test_not_a_dict(self):
+        self.assertEqual(project([RECORD], ['id']), [RECORD])
+        self.assertIsNone(project(None, ['id']))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.addons.connector.connector import Binder
+
+from ..unit.binder import (clear_identity_map,
+                           identity_map,
+                           identity_map_stats,
+                           )
+from .common import SetUpShopwareBase
+
+MODEL = 'shopware.res.partner.category'
+
+
+class TestIdentityMap(SetUpShopwareBase):
+    """ Identity map of the bindings of a transaction """
+
+    def test_rollback(self):
+        """ The map is dropped with the transaction """
+        cr = self.registry.cursor()
+        try:
+            imap = identity_map(cr)
+            self.assertIsNotNone(imap)
+            imap['key'] = (1, 1)
+            self.assertIs(identity_map(cr), imap)
+            cr.rollback()
+            self.assertEqual(identity_map(cr), {})
+        finally:
+            cr.close()
+
+    def test_clear(self):
+        """ The map is dropped on the rollback of a savepoint """
+        identity_map(self.cr)['key'] = (1, 1)
+        clear_identity_map(self.cr)
+        self.assertNotIn('key', identity_map(self.cr))
+
+    def test_lookup(self):
+        """ A bound record is found in the map """
+        binder = self.get_connector_env(MODEL).get_connector_unit(Binder)
+        binding = self.env[MODEL].create({'name': 'Retail',
+                                          'backend_id': self.backend.id})
+        binder.bind(7, binding.id)
+        hits = identity_map_stats['hits']
+        self.assertEqual(binder.to_openerp(7), binding.id)
+        self.assertEqual(identity_map_stats['hits'], hits + 1)
+        clear_identity_map(self.cr)
+        misses = identity_map_stats['misses']
+        self.assertEqual(binder.to_openerp(7), binding.id)
+        self.assertEqual(identity_map_stats['misses'], misses + 1)
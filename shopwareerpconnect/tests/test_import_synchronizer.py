@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from ..unit.import_synchronizer import ShopwareImporter, outdated_ids
+from .common import SetUpShopwareBase
+
+MODEL = 'shopware.res.partner.category'
+
+
+class TestImporter(SetUpShopwareBase):
+    """ Imports skipped when the record did not change on Shopware """
+
+    def setUp(self):
+        super(TestImporter, self).setUp()
+        self.connector_env = self.get_connector_env(MODEL)
+
+    def _import(self, record):
+        importer = self.connector_env.get_connector_unit(ShopwareImporter)
+        return importer.run(record['id'], record=record)
+
+    def _binding(self, shopware_id):
+        return self.env[MODEL].search(
+            [('backend_id', '=', self.backend.id),
+             ('shopware_id', '=', str(shopware_id))])
+
+    def test_fingerprint_unchanged(self):
+        """ The same content is not imported again """
+        self._import({'id': 7, 'key': 'Retail'})
+        binding = self._binding(7)
+        self.assertEqual(binding.name, 'Retail')
+        self.assertTrue(binding.shopware_hash)
+        self.assertEqual(self._import({'id': 7, 'key': 'Retail'}),
+                         'Content unchanged on Shopware.')
+
+    def test_fingerprint_changed(self):
+        """ A new content is imported """
+        self._import({'id': 7, 'key': 'Retail'})
+        fingerprint = self._binding(7).shopware_hash
+        self.assertIsNone(self._import({'id': 7, 'key': 'Wholesale'}))
+        binding = self._binding(7)
+        self.assertEqual(binding.name, 'Wholesale')
+        self.assertNotEqual(binding.shopware_hash, fingerprint)
+
+    def test_unchanged_sync_date(self):
+        """ A record skipped as unchanged is synchronized again """
+        self._import({'id': 7, 'key': 'Retail'})
+        binding = self._binding(7)
+        binding.write({'sync_date': '2016-01-01 00:00:00'})
+        self._import({'id': 7, 'key': 'Retail'})
+        binding.invalidate_cache()
+        self.assertGreater(binding.sync_date, '2016-01-01 00:00:00')
+
+    def test_outdated_ids(self):
+        """ The records changed since their synchronization """
+        self._import({'id': 7, 'key': 'Retail'})
+        self._binding(7).write({'sync_date': '2016-01-02 00:00:00'})
+        backend_id = self.backend.id
+        self.assertEqual(outdated_ids(self.session, MODEL, backend_id,
+                                      [(7, '2016-01-01T10:00:00')]), [])
+        self.assertEqual(outdated_ids(self.session, MODEL, backend_id,
+                                      [(7, '2016-01-03T10:00:00')]), [7])
+        self.assertEqual(outdated_ids(self.session, MODEL, backend_id,
+                                      [(7, None)]), [7])
+        # not imported yet
+        self.assertEqual(outdated_ids(self.session, MODEL, backend_id,
+                                      [(8, '2016-01-01T10:00:00')]), [8])
+
+    def test_changed_data(self):
+        """ Only the values which differ from the binding are written """
+        self._import({'id': 7, 'key': 'Retail'})
+        binding = self._binding(7)
+        importer = self.connector_env.get_connector_unit(ShopwareImporter)
+        # shopware_id is mapped as a number and stored as a string
+        self.assertEqual(importer._changed_data(
+            binding, {'shopware_id': 7, 'name': 'Retail',
+                      'backend_id': self.backend.id}), {})
+        self.assertEqual(importer._changed_data(
+            binding, {'shopware_id': 7, 'name': 'Wholesale'}),
+            {'name': 'Wholesale'})
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import json
+import unittest2
+
+from ..unit.backend_adapter import iter_json_list
+
+
+def split(document, size):
+    return [document[index:index + size]
+            for index in xrange(0, len(document), size)]
+
+
+class TestJSONStream(unittest2.TestCase):
+    """ Decoding of the lists of the API received in chunks """
+
+    def assertItems(self, document):
+        expected = json.loads(document)['data']
+        for size in xrange(1, len(document) + 1):
+            items = list(iter_json_list(split(document, size)))
+            self.assertEqual(items, expected,
+                             'chunks of %d bytes' % size)
+
+    def test_numbers(self):
+        """ Numbers split by a chunk after a sign, a dot or an exponent """
+        self.assertItems(b'{"data":[-1.5e10]}')
+        self.assertItems(b'{"data":[1, -0, 0.25, 12345678901234, 2E+3]}')
+
+    def test_values(self):
+        """ Strings, objects and constants split by the chunks """
+        self.assertItems(b'{"total": 2, "data":[{"id": 1, "name": '
+                         b'"\xc3\xa9t\xc3\xa9", "active": true}, '
+                         b'{"id": 2, "name": null}], "success": true}')
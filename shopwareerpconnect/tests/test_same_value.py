@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest2
+
+from openerp import fields
+
+from ..unit.import_synchronizer import same_value
+
+
+class TestSameValue(unittest2.TestCase):
+    """ Comparison of the mapped values with the values of a binding
+    read with ``_classic_write`` """
+
+    def test_char_number(self):
+        """ The ids of Shopware are mapped as numbers in char fields """
+        field = fields.Char()
+        self.assertTrue(same_value(field, u'5', 5))
+        self.assertTrue(same_value(field, u'5', 5L))
+        self.assertFalse(same_value(field, u'6', 5))
+        self.assertFalse(same_value(field, False, 5))
+
+    def test_char_string(self):
+        field = fields.Char()
+        self.assertTrue(same_value(field, u'\xe9t\xe9', '\xc3\xa9t\xc3\xa9'))
+        self.assertTrue(same_value(field, False, None))
+        self.assertFalse(same_value(field, u'a', u'b'))
+
+    def test_selection_number(self):
+        self.assertTrue(same_value(fields.Selection([('1', '1')]), u'1', 1))
+
+    def test_float_string(self):
+        """ The decimals are sent as strings by Shopware """
+        field = fields.Float(digits=(16, 2))
+        self.assertTrue(same_value(field, 9.99, '9.99'))
+        self.assertTrue(same_value(field, 9.99, 9.991))
+        self.assertFalse(same_value(field, 9.99, '10.5'))
+        self.assertFalse(same_value(field, 9.99, 'n/a'))
+        self.assertTrue(same_value(field, False, None))
+
+    def test_boolean(self):
+        field = fields.Boolean()
+        self.assertTrue(same_value(field, False, None))
+        self.assertFalse(same_value(field, False, 1))
+
+    def test_many2one(self):
+        field = fields.Many2one('res.partner')
+        self.assertTrue(same_value(field, 3, 3))
+        self.assertTrue(same_value(field, False, None))
+        self.assertFalse(same_value(field, 3, 4))
+
+    def test_many2many(self):
+        field = fields.Many2many('res.partner')
+        self.assertTrue(same_value(field, [2, 1], [(6, 0, [1, 2])]))
+        self.assertFalse(same_value(field, [1], [(6, 0, [1, 2])]))
+        # only a replacement of the relation can be compared
+        self.assertFalse(same_value(field, [1], [(4, 1)]))
+
+    def test_date(self):
+        field = fields.Date()
+        self.assertTrue(same_value(field, '2016-03-01',
+                                   '2016-03-01 10:00:00'))
+        self.assertFalse(same_value(field, '2016-03-01', '2016-03-02'))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import hashlib
+import hmac
+
+import unittest2
+
+from ..controllers.main import valid_signature
+
+BODY = '{"event": "order.placed", "id": 42}'
+
+
+class TestWebhookSignature(unittest2.TestCase):
+    """ Signature of the events sent by Shopware """
+
+    def setUp(self):
+        self.signature = hmac.new('secret', BODY,
+                                  hashlib.sha256).hexdigest()
+
+    def test_valid(self):
+        self.assertTrue(valid_signature(u'secret', BODY, self.signature))
+        self.assertTrue(valid_signature(u'secret', BODY,
+                                        self.signature.upper()))
+        self.assertTrue(valid_signature(u'secret', BODY,
+                                        unicode(self.signature)))
+
+    def test_invalid(self):
+        self.assertFalse(valid_signature(u'other', BODY, self.signature))
+        self.assertFalse(valid_signature(u'secret', BODY + ' ',
+                                         self.signature))
+
+    def test_malformed(self):
+        """ A malformed header is refused, never an error """
+        self.assertFalse(valid_signature(u'secret', BODY, ''))
+        self.assertFalse(valid_signature(u'secret', BODY, None))
+        self.assertFalse(valid_signature(u'secret', BODY,
+                                         self.signature[:-1]))
+        self.assertFalse(valid_signature(u'secret', BODY,
+                                         self.signature + '\n'))
+        self.assertFalse(valid_signature(u'secret', BODY, u'\xe9' * 64))
+        self.assertFalse(valid_signature(u'secret', BODY,
+                                         '\xc3\xa9' * 32))
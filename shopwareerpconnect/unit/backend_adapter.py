@@ -19,14 +19,30 @@
 #
 ##############################################################################
 
+import codecs
+import copy
+import json
+import re
 import socket
 import logging
-import xmlrpclib
-from shopware_rest import rest as shopwarelib
+import random
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from Queue import Queue, Empty
+
+import requests
+from requests.auth import HTTPDigestAuth
 
 from openerp.addons.connector.unit.backend_adapter import CRUDAdapter
 from openerp.addons.connector.exception import (NetworkRetryableError,
-                                                RetryableJobError)
+                                                RetryableJobError,
+                                                IDMissingInBackend)
+from ..api_state import throttle, report, check_circuit, report_circuit
+from ..metrics import observe, observe_retry
+from ..recorder import recorder
+from ..response_cache import cache_get, cache_put
 from datetime import datetime
 _logger = logging.getLogger(__name__)
 
@@ -34,46 +50,30 @@ _logger = logging.getLogger(__name__)
 MAGENTO_DATETIME_FORMAT = '%Y/%m/%d %H:%M:%S'
 
 
-recorder = {}
-
+RETRYABLE_STATUS_CODES = (429,  # Too many requests
+                          502,  # Bad gateway
+                          503,  # Service unavailable
+                          504)  # Gateway timeout
 
-def call_to_key(method, arguments):
-    """ Used to 'freeze' the method and arguments of a call to Shopware
-    so they can be hashable; they will be shopd in a dict.
+# ids read per call to a list endpoint by ``GenericAdapter.read_many``
+READ_MANY_LIST_SIZE = 100
 
-    Used in both the recorder and the tests.
-    """
-    def freeze(arg):
-        if isinstance(arg, dict):
-            items = dict((key, freeze(value)) for key, value
-                         in arg.iteritems())
-            return frozenset(items.iteritems())
-        elif isinstance(arg, list):
-            return tuple([freeze(item) for item in arg])
-        else:
-            return arg
+# maximum number of seconds waited before sending a call again
+MAX_BACKOFF = 10
 
-    new_args = []
-    for arg in arguments:
-        new_args.append(freeze(arg))
-    return (method, tuple(new_args))
+# bytes read at once from a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
-def record(method, arguments, result):
-    """ Utility function which can be used to record test data
-    during synchronisations. Call it from ShopwareCRUDAdapter._call
+def call_to_key(method, arguments):
+    """ Used to 'freeze' the method and arguments of a call to Shopware
+    so they can be hashable; they are used as keys of the caches.
 
-    Then ``output_recorder`` can be used to write the data recorded
-    to a file.
+    The arguments are serialized in JSON with sorted keys, which is
+    much faster than walking them in Python.
     """
-    recorder[call_to_key(method, arguments)] = result
-
-
-def output_recorder(filename):
-    import pprint
-    with open(filename, 'w') as f:
-        pprint.pprint(recorder, f)
-    _logger.debug('recorder written to file %s', filename)
+    return (method, json.dumps(arguments, sort_keys=True,
+                               separators=(',', ':'), default=unicode))
 
 
 class ShopwareLocation(object):
@@ -91,10 +91,413 @@ class ShopwareLocation(object):
         location = self._location
         return location
 
+    @property
+    def credentials(self):
+        """ Identify the Shopware instance and the user we talk to """
+        return (self._location, self.username, self.token)
+
+
+def php_params(arguments, prefix=None):
+    """ Flatten the arguments of a call to the ``key[sub][subsub]``
+    notation of the query strings understood by the Shopware (PHP) API.
+
+    Returns a list of ``(name, value)`` tuples, ``None`` values are
+    omitted.
+    """
+    if isinstance(arguments, dict):
+        items = arguments.iteritems()
+    elif isinstance(arguments, (list, tuple)):
+        items = enumerate(arguments)
+    else:
+        return [(prefix, arguments)]
+    params = []
+    for key, value in items:
+        name = '%s[%s]' % (prefix, key) if prefix else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            params.extend(php_params(value, prefix=name))
+        elif isinstance(value, bool):
+            params.append((name, int(value)))
+        elif value is not None:
+            params.append((name, value))
+    return params
+
+
+_BLANK_RE = re.compile(r'[ \t\n\r]*')
+# characters which may continue a number
+_NUMBER_RE = re.compile(r'[-+.eE0-9]*')
+
+
+class JSONStream(object):
+    """ Incremental decoder of a JSON document received in chunks
+
+    Only the part of the document not decoded yet is kept in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=0):
+        """ Read chunks until the buffer is longer than ``size``,
+        return False at the end of the document """
+        if self._eof:
+            return False
+        text = [self._buffer[self._pos:]]
+        length = len(text[0])
+        while True:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                text.append(self._utf8.decode(b'', True))
+                self._eof = True
+                break
+            text.append(self._utf8.decode(chunk))
+            length += len(text[-1])
+            if length > size:
+                break
+        self._buffer = u''.join(text)
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """ Return the next non-blank character, None at the end """
+        while True:
+            self._pos = _BLANK_RE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected %r in the JSON document, found %r'
+                             % (char, found))
+        self._pos += 1
+
+    def value(self):
+        """ Decode the next value """
+        char = self.peek()
+        if char is None:
+            raise ValueError('Unexpected end of the JSON document')
+        number = char == '-' or char.isdigit()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer,
+                                                      self._pos)
+            except ValueError:
+                # incomplete value, read at least as much again to
+                # decode it in a linear time
+                if not self._fill(2 * (len(self._buffer) - self._pos)):
+                    raise
+                continue
+            # a number is complete when another character follows
+            # it, the next chunk may continue it ("-1" of "-1.5e10")
+            if number:
+                complete = (_NUMBER_RE.match(self._buffer, end).end() <
+                            len(self._buffer))
+            else:
+                complete = True
+            if complete or not self._fill():
+                self._pos = end
+                return value
+
+    def items(self):
+        """ Yield the items of the list starting at the current
+        position """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            if char not in (',', ']'):
+                raise ValueError('Expected , or ] in the JSON document, '
+                                 'found %r' % char)
+            self._pos += 1
+            if char == ']':
+                return
+
+
+def iter_json_list(chunks, key='data'):
+    """ Yield the items of the list of a JSON response while its chunks
+    are received
+
+    The list is the document itself or the ``key`` member of the
+    envelope object of the Shopware API.
+    """
+    stream = JSONStream(chunks)
+    char = stream.peek()
+    if char is None:
+        return
+    if char != '{':
+        for item in stream.items():
+            yield item
+        return
+    stream.expect('{')
+    while stream.peek() != '}':
+        name = stream.value()
+        stream.expect(':')
+        if name == key and stream.peek() == '[':
+            for item in stream.items():
+                yield item
+        else:
+            stream.value()
+        if stream.peek() == ',':
+            stream.expect(',')
+
+
+class ShopwareClient(object):
+    """ HTTP client for the Shopware REST API.
+
+    It keeps a :class:`requests.Session`, so the TCP (and TLS)
+    connection and the digest authentication are reused between the
+    calls.  The responses are requested compressed with gzip.
+    """
+
+    def __init__(self, shopware):
+        self.shopware = shopware
+        self.session = requests.Session()
+        self.session.auth = HTTPDigestAuth(shopware.username or '',
+                                           shopware.token or '')
+        self.session.headers['Accept'] = 'application/json'
+        self.session.headers['Accept-Encoding'] = 'gzip'
+        self.last_used = time.time()
+
+    def call(self, resource, method='GET', arguments=None, stream=False,
+             timeout=None):
+        """ Send a request and return the :class:`requests.Response`
+
+        With ``stream``, only the headers of the response are read, its
+        content is read while it is iterated.
+
+        :param timeout: ``(connect, read)`` timeouts in seconds
+        """
+        url = self.shopware.location + resource
+        if method == 'GET':
+            response = self.session.get(url,
+                                        params=php_params(arguments or {}),
+                                        stream=stream,
+                                        timeout=timeout)
+        else:
+            response = self.session.request(
+                method, url,
+                data=json.dumps(arguments),
+                headers={'Content-Type': 'application/json'},
+                stream=stream,
+                timeout=timeout,
+            )
+        self.last_used = time.time()
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class ShopwareSessionPool(object):
+    """ Keep-alive clients for one backend in the current worker process.
+
+    At most ``size`` idle clients are kept, clients unused for more
+    than ``idle_timeout`` seconds are closed.  When all the clients are
+    busy, a new one is opened and closed after use if the pool is full.
+    """
+
+    def __init__(self, shopware, size, idle_timeout):
+        self.shopware = shopware
+        self.credentials = shopware.credentials
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        now = time.time()
+        idle = []
+        for client in self._idle:
+            if now - client.last_used > self.idle_timeout:
+                client.close()
+            else:
+                idle.append(client)
+        self._idle = idle
+
+    def acquire(self):
+        with self._lock:
+            self._evict()
+            if self._idle:
+                return self._idle.pop()
+        return ShopwareClient(self.shopware)
+
+    def release(self, client):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(client)
+                return
+        client.close()
+
+    def close(self):
+        with self._lock:
+            for client in self._idle:
+                client.close()
+            self._idle = []
+
+    @contextmanager
+    def client(self):
+        """ Context manager giving a client of the pool.
+
+        A client which failed on a network error is not given back to
+        the pool, its connection may be broken.
+        """
+        client = self.acquire()
+        try:
+            yield client
+        except Exception:
+            client.close()
+            raise
+        self.release(client)
+
+
+_session_pools = {}
+_session_pools_lock = threading.Lock()
+
+
+def get_session_pool(backend, shopware):
+    """ Return the pool of clients of a backend.
+
+    The pool is rebuilt when the location, the credentials or the pool
+    configuration of the backend have changed.
+    """
+    key = (backend.env.cr.dbname, backend.id)
+    size = backend.connection_pool_size
+    idle_timeout = backend.connection_idle_timeout
+    with _session_pools_lock:
+        pool = _session_pools.get(key)
+        if (pool is None or
+                pool.credentials != shopware.credentials or
+                pool.size != size or
+                pool.idle_timeout != idle_timeout):
+            if pool is not None:
+                pool.close()
+            pool = ShopwareSessionPool(shopware, size, idle_timeout)
+            _session_pools[key] = pool
+    return pool
+
+
+def invalidate_session_pool(dbname, backend_id):
+    """ Close the clients of a backend, they will be rebuilt on the
+    next call """
+    with _session_pools_lock:
+        pool = _session_pools.pop((dbname, backend_id), None)
+    if pool is not None:
+        pool.close()
+
+
+# pools inherited from the parent by a forked process, kept referenced
+# so their connections are never closed by the child
+_inherited_pools = []
+
+
+def forget_session_pools():
+    """ Drop the clients inherited from the parent process, called in a
+    forked process: their sockets are shared with the parent, the child
+    opens its own clients """
+    global _session_pools_lock
+    _inherited_pools.append(dict(_session_pools))
+    _session_pools.clear()
+    _session_pools_lock = threading.Lock()
+
+
+def project(record, attributes):
+    """ Keep only the given keys of a record
+
+    The API may ignore the ``attributes`` of a read and return the full
+    record; the callers get the same keys in any case.
+    """
+    if (not isinstance(attributes, (list, tuple)) or
+            not isinstance(record, dict)):
+        return record
+    return dict((key, record[key]) for key in attributes if key in record)
+
+
+# result of the read of a record by ``GenericAdapter.read_many``: the
+# record, or the exception raised by its read
+ReadResult = namedtuple('ReadResult', ['id', 'record', 'error'])
+
+
+class _Flight(object):
+    """ A read in progress, or done less than its TTL ago """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+# a caller waiting for the read of another thread gives up after this
+# number of seconds and reads the record itself
+FLIGHT_WAIT_TIMEOUT = 120
+# the expired reads are cleared when there are more reads kept
+FLIGHTS_SWEEP_SIZE = 1000
+
+
+def single_flight(key, fetch, ttl=0):
+    """ Call ``fetch`` once for the concurrent callers using the same key
+
+    The first caller fetches the result, the callers arriving meanwhile
+    wait for it.  With a ``ttl``, the result is also given to the
+    callers of the next ``ttl`` seconds.  Each caller gets its own copy
+    of the result.
+    """
+    with _flights_lock:
+        now = time.time()
+        flight = _flights.get(key)
+        if flight is not None and flight.expires and flight.expires < now:
+            flight = None
+        leader = flight is None
+        if leader:
+            if len(_flights) > FLIGHTS_SWEEP_SIZE:
+                for flight_key, other in _flights.items():
+                    if other.expires and other.expires < now:
+                        del _flights[flight_key]
+            flight = _flights[key] = _Flight()
+    if not leader:
+        if not flight.done.wait(FLIGHT_WAIT_TIMEOUT):
+            return fetch()
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.result)
+    try:
+        flight.result = fetch()
+    except Exception as err:
+        flight.error = err
+        raise
+    else:
+        if ttl:
+            flight.expires = time.time() + ttl
+        return copy.deepcopy(flight.result)
+    finally:
+        if flight.error is not None or not ttl:
+            with _flights_lock:
+                if _flights.get(key) is flight:
+                    del _flights[key]
+        flight.done.set()
+
 
 class ShopwareCRUDAdapter(CRUDAdapter):
     """ External Records Adapter for Shopware """
 
+    # seconds during which the records read are cached, for the
+    # resources which almost never change; the searches are never
+    # cached so the batch imports always see the new records
+    _cache_ttl = 0
+
     def __init__(self, connector_env):
         """
 
@@ -135,38 +538,254 @@ class ShopwareCRUDAdapter(CRUDAdapter):
         """ Delete a record on the external system """
         raise NotImplementedError
 
-    def _call(self, resource, arguments, method='GET'):
-        try:
-            _logger.debug("Start calling Shopware api %s", method)
-            client = shopwarelib.sapi()
-            client.setCredentials(self.shopware.username,
-                                  self.shopware.token,
-                                  self.shopware.location)
-            result = client.call(resource, method, arguments, arguments)
-
-            if type(result) is type(bool) and result is False:
-                raise NetworkRetryableError(
-                    'Shopware API could not be reached.'
-                )
+    def _call(self, resource, arguments, method='GET', stream=False):
+        """ Call Shopware and return the data of the response
 
+        With ``stream``, the response must be a list: an iterator on its
+        items is returned, they are decoded while they are received.
+        """
+        if stream:
+            return self._request(resource, arguments, method=method,
+                                 stream=True)
+        if self._cache_ttl and method == 'GET' and '/' in resource:
+            backend = self.backend_record
+            dbname = self.session.cr.dbname
+            hit, result = cache_get(backend, dbname, resource, arguments,
+                                    call_to_key)
+            if hit:
+                _logger.debug("Shopware api %s %s served from the cache",
+                              method, resource)
+                return result
+            result = self._request(resource, arguments, method=method)
+            cache_put(backend, dbname, resource, arguments, result,
+                      self._cache_ttl, call_to_key)
             return result
-        except (socket.gaierror, socket.error, socket.timeout) as err:
+        return self._request(resource, arguments, method=method)
+
+    def _request(self, resource, arguments, method='GET', stream=False):
+        """ Send a call to Shopware and return the data of the
+        response
+
+        The reads failing on a network error or on a gateway error are
+        sent again up to ``api_retries`` times, after an exponential
+        backoff, before the job is retried.
+        """
+        backend = self.backend_record
+        pool = get_session_pool(backend, self.shopware)
+        timeout = self._timeout(resource)
+        # only the reads are idempotent
+        retries = backend.api_retries if method == 'GET' else 0
+        attempt = 0
+        while True:
+            if backend.circuit_failure_threshold:
+                check_circuit(self.session.cr.dbname, backend.id,
+                              backend.circuit_cooldown)
+            throttle(self.session.cr.dbname, backend.id,
+                     backend.api_rate_limit)
+            start = time.time()
+            # not ``pool.client()``: the client of a streamed response
+            # goes back to the pool once the response is read
+            client = pool.acquire()
+            try:
+                response = client.call(resource, method, arguments,
+                                       stream=stream, timeout=timeout)
+            except (socket.gaierror, socket.error, socket.timeout,
+                    requests.ConnectionError, requests.Timeout) as err:
+                # its connection may be broken
+                client.close()
+                self._observe(resource, method, start)
+                if attempt < retries:
+                    attempt += 1
+                    self._backoff(resource, method, attempt, err)
+                    continue
+                raise NetworkRetryableError(
+                    'A network error caused the failure of the job: '
+                    '%s' % err)
+            except Exception:
+                client.close()
+                raise
+            if stream and response.ok:
+                return self._stream(resource, arguments, method, response,
+                                    start, lambda: pool.release(client))
+            if stream:
+                # read the body of the error before the client is reused
+                response.content
+            pool.release(client)
+            self._observe(resource, method, start, response=response)
+            if (response.status_code in RETRYABLE_STATUS_CODES and
+                    attempt < retries):
+                retry_after = self._retry_after(response)
+                # a long wait is left to the queue of jobs
+                if retry_after is None or retry_after <= MAX_BACKOFF:
+                    response.close()
+                    attempt += 1
+                    self._backoff(resource, method, attempt,
+                                  '%s %s' % (response.status_code,
+                                             response.reason),
+                                  minimum=retry_after)
+                    continue
+            break
+        result = self._handle_response(response)
+        if stream:
+            # the callers expect an iterator: a streamed call which did
+            # not succeed must raise
+            raise requests.HTTPError(
+                'Unexpected response %s %s to a streamed call' %
+                (response.status_code, response.reason), response=response)
+        if recorder.wants(resource):
+            recorder.add(resource, method, arguments, body=response.content)
+        return result
+
+    def _stream(self, resource, arguments, method, response, start,
+                release):
+        """ Yield the items of the list of a streamed response
+
+        The call is observed once the response is read, with the time
+        spent until its headers were received: the time spent by the
+        caller on the items must not be taken for a slow response.
+        ``release`` gives the client back to the pool, when the items
+        are exhausted or the generator is closed.
+        """
+        seconds = time.time() - start
+        received = [0]
+        recorded = [] if recorder.wants(resource) else None
+
+        def chunks():
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                received[0] += len(chunk)
+                yield chunk
+
+        failed = False
+        try:
+            for item in iter_json_list(chunks()):
+                if recorded is not None:
+                    if received[0] > recorder.max_bytes:
+                        # the list would not fit in the buffer of the
+                        # recorder, stop keeping its items
+                        recorded = None
+                        recorder.dropped += 1
+                    else:
+                        recorded.append(item)
+                yield item
+        except (socket.error, socket.timeout,
+                requests.RequestException) as err:
+            failed = True
             raise NetworkRetryableError(
                 'A network error caused the failure of the job: '
                 '%s' % err)
-        except xmlrpclib.ProtocolError as err:
-            if err.errcode in [502,   # Bad gateway
-                               503,   # Service unavailable
-                               504]:  # Gateway timeout
-                raise RetryableJobError(
-                    'A protocol error caused the failure of the job:\n'
-                    'URL: %s\n'
-                    'HTTP/HTTPS headers: %s\n'
-                    'Error code: %d\n'
-                    'Error message: %s\n' %
-                    (err.url, err.headers, err.errcode, err.errmsg))
+        finally:
+            response.close()
+            release()
+            self._observe(resource, method, start,
+                          response=None if failed else response,
+                          bytes_in=received[0], seconds=seconds)
+        if recorded is not None:
+            recorder.add(resource, method, arguments, result=recorded,
+                         size=received[0])
+
+    def _observe(self, resource, method, start, response=None,
+                 bytes_in=None, seconds=None):
+        """ Log a call, add it to the metrics of the backend and report
+        the response to the rate limit and to the circuit breaker
+
+        Without response, the call failed on a network error.
+        """
+        if seconds is None:
+            seconds = time.time() - start
+        if response is None:
+            status = None
+            outcome = 'retry'
+            bytes_in = bytes_out = 0
+        else:
+            status = response.status_code
+            if status == 404:
+                outcome = 'missing'
+            elif status in RETRYABLE_STATUS_CODES:
+                outcome = 'retry'
+            elif status >= 400:
+                outcome = 'error'
             else:
-                raise
+                outcome = 'success'
+            if bytes_in is None:
+                bytes_in = len(response.content)
+            request = response.request
+            bytes_out = len(request.url) + len(request.body or '')
+        _logger.debug("Shopware api %s %s: status %s, %d bytes in, "
+                      "%d bytes out, %.3fs, %s", method, resource, status,
+                      bytes_in, bytes_out, seconds, outcome)
+        backend = self.backend_record
+        dbname = self.session.cr.dbname
+        observe(dbname, backend.id, resource, method, status,
+                bytes_in, bytes_out, seconds, outcome)
+        report(dbname, backend.id, backend.api_rate_limit, status, seconds,
+               slow_threshold=backend.api_slow_threshold)
+        report_circuit(dbname, backend.id, status,
+                       backend.circuit_failure_threshold,
+                       backend.circuit_cooldown,
+                       max_rate=backend.api_rate_limit)
+
+    def _handle_response(self, response):
+        """ Return the data of a response of the Shopware API """
+        if response.status_code == 404:
+            raise IDMissingInBackend
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            raise RetryableJobError(
+                'A protocol error caused the failure of the job:\n'
+                'URL: %s\n'
+                'HTTP/HTTPS headers: %s\n'
+                'Error code: %d\n'
+                'Error message: %s\n' %
+                (response.url, response.headers, response.status_code,
+                 response.reason),
+                seconds=self._retry_after(response))
+        response.raise_for_status()
+        if not response.content:
+            return True
+        result = response.json()
+        # the Shopware API wraps the records in a 'data' envelope
+        if isinstance(result, dict) and 'data' in result:
+            return result['data']
+        return result
+
+    def _timeout(self, resource):
+        """ Connect and read timeouts of the calls to a resource
+
+        The timeouts of the longest resource configured on the backend
+        matching the beginning of ``resource`` are used, the ones of
+        the backend otherwise.
+        """
+        backend = self.backend_record
+        connect, read = backend.api_connect_timeout, backend.api_read_timeout
+        matched = ''
+        for timeout in backend.api_timeout_ids:
+            if (resource.startswith(timeout.resource) and
+                    len(timeout.resource) > len(matched)):
+                matched = timeout.resource
+                connect, read = timeout.connect_timeout, timeout.read_timeout
+        return (connect or None, read or None)
+
+    def _backoff(self, resource, method, attempt, reason, minimum=None):
+        """ Wait before sending a call again
+
+        The wait is a random duration up to ``api_backoff`` seconds
+        doubled at each attempt (full jitter), so the workers failing
+        together do not retry together.
+        """
+        backend = self.backend_record
+        bound = min(MAX_BACKOFF, backend.api_backoff * 2 ** (attempt - 1))
+        delay = max(random.uniform(0, bound), minimum or 0)
+        observe_retry(self.session.cr.dbname, backend.id, resource, method)
+        _logger.info('Shopware api %s %s failed (%s), attempt %d in %.2fs',
+                     method, resource, reason, attempt + 1, delay)
+        time.sleep(delay)
+
+    def _retry_after(self, response):
+        """ Seconds to wait before a retry, given by the ``Retry-After``
+        header of a response """
+        try:
+            return int(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
 
 
 class GenericAdapter(ShopwareCRUDAdapter):
@@ -174,22 +793,216 @@ class GenericAdapter(ShopwareCRUDAdapter):
     _model_name = None
     _shopware_model = None
 
-    def search(self, filters=None):
+    # walk the pages of a search with a filter on the last id seen
+    # rather than with an offset (stable when records change meanwhile)
+    _search_keyset = False
+    # seconds during which the result of a read is shared with the
+    # other reads of the same record in the process; the concurrent
+    # reads are always shared
+    _read_ttl = 0
+    # the list endpoint of the resource returns the same records as the
+    # reads and accepts a filter on the ids: ``read_many`` uses it
+    _read_many_list = False
+
+    def search(self, filters=None, page_size=None, stream=False,
+               changed=False):
         """ Search records according to some criterias
         and returns a list of ids
 
+        When a ``page_size`` is given, the search is done page by page
+        and a generator yielding a list of ids per page is returned.
+        Otherwise, with ``stream``, an iterator on the ids decoded while
+        the response is received is returned.
+
+        With ``changed``, the list endpoint is read page by page
+        (``page_size`` is required) and the pages are lists of
+        ``(id, changed)``, the last update of the records on Shopware.
+
         :rtype: list
         """
+        if changed:
+            return ([(record['id'], record.get('changed'))
+                     for record in records]
+                    for records in self.list_pages(
+                        page_size, filters=filters,
+                        attributes=['id', 'changed']))
+        if page_size:
+            if self._search_keyset:
+                return self._search_pages_keyset(filters, page_size)
+            return self._search_pages(filters, page_size)
         return self._call('%sSearch' % self._shopware_model,
-                          {'filter': filters} if filters else {})
-
-    def read(self, id, attributes=None):
+                          {'filter': filters} if filters else {},
+                          stream=stream)
+
+    def _search_pages(self, filters, page_size):
+        """ Walk a search with the ``start`` / ``limit`` parameters """
+        start = 0
+        while True:
+            arguments = {'start': start, 'limit': page_size}
+            if filters:
+                arguments['filter'] = filters
+            record_ids = self._call('%sSearch' % self._shopware_model,
+                                    arguments)
+            if record_ids:
+                yield record_ids
+            if len(record_ids) != page_size:
+                # last page, or the resource does not support the
+                # pagination and returned everything at once
+                return
+            start += page_size
+
+    def _search_pages_keyset(self, filters, page_size):
+        """ Walk a search ordered by id, each page starting after the
+        last id of the previous page """
+        filters = dict(filters or {})
+        index = max(filters) + 1 if filters else 0
+        last_id = None
+        while True:
+            if last_id is not None:
+                filters[index] = {'property': 'id',
+                                  'expression': '>',
+                                  'value': last_id}
+            arguments = {'filter': filters,
+                         'sort': [{'property': 'id', 'direction': 'ASC'}],
+                         'limit': page_size}
+            record_ids = self._call('%sSearch' % self._shopware_model,
+                                    arguments)
+            if last_id is not None:
+                if any(int(record_id) <= last_id for record_id in record_ids):
+                    _logger.warning('%s does not support the keyset '
+                                    'pagination, stopped the search',
+                                    self._shopware_model)
+                    return
+            if record_ids:
+                yield record_ids
+            if len(record_ids) != page_size:
+                return
+            last_id = max(int(record_id) for record_id in record_ids)
+
+    def list_pages(self, page_size, filters=None, attributes=None):
+        """ Read all the records with the list endpoint of the resource
+        and return a generator yielding a list of records per page
+
+        The records of the list may have fewer keys than the ones
+        returned by ``read``.  When ``attributes`` are given, only these
+        keys are requested and returned.
+        """
+        start = 0
+        while True:
+            arguments = {'start': start, 'limit': page_size}
+            if filters:
+                arguments['filter'] = filters
+            if attributes:
+                arguments['attributes'] = attributes
+            records = self._call(self._shopware_model, arguments)
+            if records:
+                yield [project(record, attributes) for record in records]
+            if len(records) != page_size:
+                return
+            start += page_size
+
+    def read(self, id, attributes=None, shop_id=None):
         """ Returns the information of a record
 
+        When ``attributes`` are given, only these keys of the record
+        are requested and returned.
+
+        :param shop_id: Shopware id of the shop whose translation of
+                        the record is read, the default one if None
         :rtype: dict
         """
-        return self._call('%s' % self._shopware_model + '/' + str(id),
-                          {'attributes' : attributes})
+        resource = '%s/%s' % (self._shopware_model, id)
+        arguments = {'attributes': attributes}
+        if shop_id is not None:
+            arguments['language'] = shop_id
+        record = self._single_flight(
+            resource, arguments,
+            lambda: self._call(resource, arguments))
+        return project(record, attributes)
+
+    def read_many(self, ids, attributes=None):
+        """ Read several records
+
+        With ``_read_many_list``, the records are read with the list
+        endpoint, ``READ_MANY_LIST_SIZE`` ids per call.  Otherwise they
+        are read concurrently by at most ``connection_pool_size``
+        threads using the clients of the pool.
+
+        :return: a :class:`ReadResult` per id, in the order of ``ids``;
+                 the ``error`` of a result is the exception raised by
+                 the read of the record, e.g. :class:`IDMissingInBackend`
+        :rtype: list
+        """
+        ids = list(ids)
+        if self._read_many_list:
+            results = []
+            for index in xrange(0, len(ids), READ_MANY_LIST_SIZE):
+                results += self._read_list(
+                    ids[index:index + READ_MANY_LIST_SIZE], attributes)
+            return results
+        return self._read_threads(ids, attributes)
+
+    def _read_list(self, ids, attributes):
+        """ Read records with one call to the list endpoint """
+        arguments = {'filter': [{'property': 'id',
+                                 'expression': 'IN',
+                                 'value': [int(id) for id in ids]}],
+                     'limit': len(ids)}
+        try:
+            records = self._call(self._shopware_model, arguments)
+        except Exception as err:
+            return [ReadResult(id, None, err) for id in ids]
+        records = dict((int(record['id']), record) for record in records)
+        results = []
+        for id in ids:
+            record = records.get(int(id))
+            if record is None:
+                results.append(ReadResult(id, None, IDMissingInBackend()))
+            else:
+                results.append(ReadResult(id, project(record, attributes),
+                                          None))
+        return results
+
+    def _read_threads(self, ids, attributes):
+        """ Read records concurrently, one call per record """
+        results = [None] * len(ids)
+        pending = Queue()
+        for index, id in enumerate(ids):
+            pending.put((index, id))
+
+        def read():
+            while True:
+                try:
+                    index, id = pending.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[index] = ReadResult(
+                        id, self.read(id, attributes=attributes), None)
+                except Exception as err:
+                    results[index] = ReadResult(id, None, err)
+
+        backend = self.backend_record
+        size = min(len(ids), max(backend.connection_pool_size, 1))
+        if size <= 1:
+            read()
+            return results
+        # the threads use the values of the backend, they must be in
+        # the cache: the cursor of the transaction is not thread-safe
+        backend.api_timeout_ids.mapped('resource')
+        threads = [threading.Thread(target=read) for __ in xrange(size)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _single_flight(self, resource, arguments, fetch):
+        """ Share the result of ``fetch`` with the identical reads
+        done concurrently in the process, see :func:`single_flight` """
+        key = (self.session.cr.dbname, self.backend_record.id,
+               call_to_key(resource, arguments))
+        return single_flight(key, fetch, ttl=self._read_ttl)
 
     def search_read(self, filters=None):
         """ Search records according to some criterias
@@ -24,6 +24,38 @@ from openerp.addons.connector.connector import Binder
 from ..backend import shopware
 
 
+# lookups of the bindings answered by / missed in the identity maps
+# of the current process
+identity_map_stats = {'hits': 0, 'misses': 0}
+
+
+def identity_map(cr):
+    """ Return the identity map of the bindings for the current
+    transaction of the cursor.
+
+    The map is dropped on commit and rollback.  It returns None when the
+    cursor cannot notify the end of its transactions, in which case
+    nothing is cached.
+    """
+    imap = getattr(cr, '_shopware_identity_map', None)
+    if imap is None:
+        if not hasattr(cr, 'after'):
+            return None
+        imap = cr._shopware_identity_map = {}
+        cr.after('commit', lambda: clear_identity_map(cr))
+        cr.after('rollback', lambda: clear_identity_map(cr))
+    return imap
+
+
+def clear_identity_map(cr):
+    """ Drop the identity map of the bindings of a cursor.
+
+    Must be called when a savepoint is rolled back, since the bindings
+    created inside it no longer exist.
+    """
+    cr.__dict__.pop('_shopware_identity_map', None)
+
+
 class ShopwareBinder(Binder):
     """ Generic Binder for Shopware """
 
@@ -64,18 +96,106 @@ class ShopwareModelBinder(ShopwareBinder):
                  or an empty recordset if no binding is found
         :rtype: recordset
         """
-        bindings = self.model.with_context(active_test=False).search(
-            [('shopware_id', '=', str(external_id)),
-             ('backend_id', '=', self.backend_record.id)]
-        )
-        if not bindings:
-            return self.model.browse() if browse else None
-        assert len(bindings) == 1, "Several records found: %s" % (bindings,)
+        imap = identity_map(self.session.cr)
+        key = self._identity_key(external_id)
+        if imap is not None and key in imap:
+            identity_map_stats['hits'] += 1
+            binding_id, openerp_id = imap[key]
+            bindings = self.model.browse(binding_id)
+        else:
+            identity_map_stats['misses'] += 1
+            bindings = self.model.with_context(active_test=False).search(
+                [('shopware_id', '=', str(external_id)),
+                 ('backend_id', '=', self.backend_record.id)]
+            )
+            if not bindings:
+                return self.model.browse() if browse else None
+            assert len(bindings) == 1, (
+                "Several records found: %s" % (bindings,))
+            binding_id, openerp_id = bindings.id, None
         if unwrap:
-            return bindings.openerp_id if browse else bindings.openerp_id.id
+            if openerp_id is None:
+                openerp_id = bindings.openerp_id.id
+            if imap is not None:
+                self._remember(imap, key, binding_id, openerp_id)
+            if browse:
+                return self.env[self.unwrap_model()].browse(openerp_id)
+            return openerp_id
         else:
+            if imap is not None:
+                self._remember(imap, key, binding_id, openerp_id)
             return bindings if browse else bindings.id
 
+    def _identity_key(self, external_id):
+        """ Key of a binding in the identity map """
+        return (self.backend_record.id, self.model._name, str(external_id))
+
+    def _remember(self, imap, key, binding_id, openerp_id):
+        """ Store a binding in the identity map """
+        # forget the former external ID of the binding, if it has
+        # been bound to another one
+        reverse_key = (self.model._name, binding_id)
+        former_key = imap.get(reverse_key)
+        if former_key is not None and former_key != key:
+            imap.pop(former_key, None)
+        imap[key] = (binding_id, openerp_id)
+        imap[reverse_key] = key
+
+    def to_openerp_many(self, external_ids, unwrap=False, browse=False):
+        """ Give the OpenERP IDs for several external IDs
+
+        The bindings are searched with a single SQL query.
+
+        :param external_ids: list of external IDs
+        :param unwrap: if True, returns the normal records (the ones
+                       inherits'ed), else return the binding records
+        :param browse: if True, the values are recordsets
+        :return: dict with the external IDs as keys and the OpenERP IDs
+                 (or recordsets) as values, the external IDs without
+                 binding are not in the dict
+        :rtype: dict
+        """
+        imap = identity_map(self.session.cr)
+        if imap is None:
+            imap = {}
+        found = {}
+        keys = {}
+        for external_id in external_ids:
+            key = self._identity_key(external_id)
+            if key in imap and (not unwrap or imap[key][1] is not None):
+                identity_map_stats['hits'] += 1
+                found[external_id] = imap[key]
+            else:
+                keys[str(external_id)] = external_id
+        if keys:
+            identity_map_stats['misses'] += len(keys)
+            if 'openerp_id' in self.model._fields:
+                columns = 'shopware_id, id, openerp_id'
+            else:
+                columns = 'shopware_id, id, NULL'
+            sql = ("SELECT %s FROM %s "
+                   "WHERE backend_id = %%s AND shopware_id IN %%s" %
+                   (columns, self.model._table))
+            self.session.cr.execute(sql, (self.backend_record.id,
+                                          tuple(keys)))
+            for shopware_id, binding_id, openerp_id in (
+                    self.session.cr.fetchall()):
+                external_id = keys[shopware_id]
+                found[external_id] = (binding_id, openerp_id)
+                self._remember(imap, self._identity_key(external_id),
+                               binding_id, openerp_id)
+        if unwrap:
+            model = self.env[self.unwrap_model()]
+        else:
+            model = self.model
+        result = {}
+        for external_id, (binding_id, openerp_id) in found.iteritems():
+            record_id = openerp_id if unwrap else binding_id
+            if browse:
+                record_id = model.browse(record_id)
+            result[external_id] = record_id
+        return result
+
     def to_backend(self, record_id, wrap=False):
         """ Give the external ID for an OpenERP ID
 
@@ -108,6 +228,37 @@ class ShopwareModelBinder(ShopwareBinder):
         assert record
         return record.shopware_id
 
+    def to_backend_many(self, record_ids, wrap=False):
+        """ Give the external IDs for several OpenERP IDs
+
+        The bindings are searched with a single SQL query.
+
+        :param record_ids: list of OpenERP IDs or a recordset
+        :param wrap: if False, record_ids are the IDs of the bindings,
+            if True, they are the IDs of the normal records and the
+            bindings of the current backend are searched
+        :return: dict with the OpenERP IDs as keys and the external IDs
+                 as values, the records without binding (or without
+                 external ID) are not in the dict
+        :rtype: dict
+        """
+        if isinstance(record_ids, openerp.models.BaseModel):
+            record_ids = record_ids.ids
+        if not record_ids:
+            return {}
+        if wrap:
+            sql = ("SELECT openerp_id, shopware_id FROM %s "
+                   "WHERE openerp_id IN %%s AND backend_id = %%s" %
+                   self.model._table)
+            params = (tuple(record_ids), self.backend_record.id)
+        else:
+            sql = ("SELECT id, shopware_id FROM %s WHERE id IN %%s" %
+                   self.model._table)
+            params = (tuple(record_ids),)
+        self.session.cr.execute(sql, params)
+        return dict((record_id, shopware_id) for record_id, shopware_id
+                    in self.session.cr.fetchall() if shopware_id)
+
     def bind(self, external_id, binding_id):
         """ Create the link between an external ID and an OpenERP ID and
         update the last synchronization date.
@@ -130,6 +281,11 @@ class ShopwareModelBinder(ShopwareBinder):
             {'shopware_id': str(external_id),
              'sync_date': now_fmt,
              })
+        imap = identity_map(self.session.cr)
+        if imap is not None:
+            key = self._identity_key(external_id)
+            if imap.get(key, (None,))[0] != binding_id.id:
+                self._remember(imap, key, binding_id.id, None)
 
     def unwrap_binding(self, binding_id, browse=False):
         """ For a binding record, gives the normal record.
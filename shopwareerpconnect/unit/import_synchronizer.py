@@ -31,22 +31,145 @@ are already bound, to update the last sync date.
 
 """
 
+import hashlib
+import json
 import logging
-from openerp import fields, _
+from itertools import islice
+from collections import OrderedDict, defaultdict
+from openerp import models, fields, _
+from openerp.tools import float_compare
 from openerp.addons.connector.queue.job import job, related_action
 from openerp.addons.connector.connector import ConnectorUnit
 from openerp.addons.connector.unit.synchronizer import Importer
-from openerp.addons.connector.exception import IDMissingInBackend
+from openerp.addons.connector.exception import (IDMissingInBackend,
+                                                RetryableJobError,
+                                                )
 from ..backend import shopware
 from ..connector import get_environment, add_checkpoint
+from .binder import clear_identity_map, identity_map_stats
+from .mapper import source_fields
 from ..related_action import link
 
 _logger = logging.getLogger(__name__)
 
 
+# ids per page when the ids of a search are streamed
+STREAM_PAGE_SIZE = 1000
+# levels of dependencies of dependencies followed by the planner
+MAX_PLAN_DEPTH = 10
+
+# outcome of the imports of the current process, per model
+import_stats = defaultdict(lambda: {'imported': 0,
+                                    'uptodate': 0,
+                                    'unchanged': 0})
+# updates of the bindings of the current process, per model: the
+# writes done and avoided because no value changed, and the fields
+# written and left out of the writes because their value is the same
+write_stats = defaultdict(lambda: {'written': 0,
+                                   'avoided': 0,
+                                   'fields_written': 0,
+                                   'fields_avoided': 0})
+
+
+def same_value(field, current, value):
+    """ Return True when writing ``value`` in ``field`` would not
+    change its ``current`` value, as read with ``_classic_write`` """
+    if field.type in ('one2many', 'many2many'):
+        # only a replacement of the whole relation can be compared
+        if (isinstance(value, list) and len(value) == 1 and
+                value[0][0] == 6):
+            return set(value[0][2]) == set(current or [])
+        return False
+    if field.type == 'many2one':
+        if isinstance(value, models.BaseModel):
+            value = value.id
+        return (value or False) == (current or False)
+    if field.type == 'boolean':
+        return bool(value) == bool(current)
+    if field.type == 'float':
+        if value in (None, False) or current in (None, False):
+            return value in (None, False) and current in (None, False)
+        # Shopware sends the decimals as strings, a value which cannot
+        # be compared is written
+        try:
+            value, current = float(value), float(current)
+        except (TypeError, ValueError):
+            return False
+        digits = field.digits[1] if field.digits else 10
+        return float_compare(value, current, precision_digits=digits) == 0
+    if field.type in ('date', 'datetime') and value:
+        if not isinstance(value, basestring):
+            value = field.to_string(value)
+        if field.type == 'date':
+            # a datetime written in a date keeps only its date
+            value = value[:10]
+        return value == current
+    if (field.type in ('char', 'text', 'html', 'selection') and
+            isinstance(value, (int, long, float)) and
+            not isinstance(value, bool)):
+        # the mappers give the ids of Shopware as numbers, they are
+        # stored as strings
+        value = unicode(value)
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    if value is None:
+        value = False
+    return value == current
+
+
+def chunked(iterable, size):
+    """ Yield lists of ``size`` items of an iterable """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def is_uptodate(changed, sync_date):
+    """ Return True when a binding synchronized at ``sync_date`` is
+    more recent than the last update ``changed`` of the record on
+    Shopware """
+    if not changed or not sync_date:
+        return False
+    from_string = fields.Datetime.from_string
+    if isinstance(sync_date, basestring):
+        sync_date = from_string(sync_date)
+    return from_string(changed.replace('T', ' ')) < sync_date
+
+
+def outdated_ids(session, model_name, backend_id, records):
+    """ Return the ids of the records which have to be imported: not
+    imported yet or updated on Shopware since their last synchronization
+
+    The ``sync_date`` of the bindings are read with one query.
+
+    :param records: list of ``(shopware id, changed)``
+    """
+    if not records:
+        return []
+    model = session.env[model_name]
+    session.cr.execute("SELECT shopware_id, sync_date FROM %s "
+                       "WHERE backend_id = %%s AND shopware_id IN %%s"
+                       % model._table,
+                       (backend_id, tuple(str(shopware_id) for
+                                          shopware_id, __ in records)))
+    sync_dates = dict(session.cr.fetchall())
+    return [shopware_id for shopware_id, changed in records
+            if not is_uptodate(changed, sync_dates.get(str(shopware_id)))]
+
+
 class ShopwareImporter(Importer):
     """ Base importer for Shopware """
 
+    # keys of the Shopware record ignored by the fingerprint, because
+    # they change without any change of the content
+    _fingerprint_exclude = ('changed',)
+    # keys of the Shopware record used by the importer itself, they are
+    # read with the ones used by the mapper (see ``source_fields``)
+    _source_fields = ('id', 'changed')
+
     def __init__(self, connector_env):
         """
         :param connector_env: current environment (backend, session, ...)
@@ -55,10 +178,26 @@ class ShopwareImporter(Importer):
         super(ShopwareImporter, self).__init__(connector_env)
         self.shopware_id = None
         self.shopware_record = None
+        self._read_record = None
+        # records read beforehand by an :class:`ImportPlanner`, by
+        # (binding model, shopware id)
+        self._prefetched = {}
 
     def _get_shopware_data(self):
         """ Return the raw Shopware data for ``self.shopware_id`` """
-        return self.backend_adapter.read(self.shopware_id)
+        if self._read_record is not None:
+            return self._read_record
+        return self.backend_adapter.read(self.shopware_id,
+                                         attributes=self._read_fields())
+
+    def _read_fields(self):
+        """ Return the keys of the Shopware record needed by the import,
+        None when the full record is needed """
+        fields = source_fields(self.mapper)
+        if fields is None:
+            return None
+        fields.update(self._source_fields)
+        return sorted(fields)
 
     def _before_import(self):
         """ Hook called before the import, when we have the Shopware
@@ -72,19 +211,41 @@ class ShopwareImporter(Importer):
             return  # no update date on Shopware, always import it.
         if not binding:
             return  # it does not exist so it should not be skipped
-        sync = binding.sync_date
-        if not sync:
-            return
-        from_string = fields.Datetime.from_string
-        sync_date = from_string(sync)
-        shopware_date = from_string(self.shopware_record['changed'].replace('T', ' '))
         # if the last synchronization date is greater than the last
         # update in shopware, we skip the import.
         # Important: at the beginning of the exporters flows, we have to
         # check if the shopware_date is more recent than the sync_date
         # and if so, schedule a new import. If we don't do that, we'll
         # miss changes done in Shopware
-        return shopware_date < sync_date
+        return is_uptodate(self.shopware_record['changed'],
+                           binding.sync_date)
+
+    def _fingerprint(self):
+        """ Return a stable hash of the content of the Shopware record """
+        record = dict((key, value) for key, value
+                      in self.shopware_record.iteritems()
+                      if key not in self._fingerprint_exclude)
+        content = json.dumps(record, sort_keys=True, default=unicode)
+        return hashlib.sha1(content).hexdigest()
+
+    def _is_unchanged(self, binding, fingerprint):
+        """ Return True if the content of the record did not change
+        on Shopware since the last import """
+        return bool(binding) and binding.shopware_hash == fingerprint
+
+    def _count(self, outcome):
+        """ Count the outcome of an import in ``import_stats`` """
+        stats = import_stats[self.model._name]
+        stats[outcome] += 1
+        total = sum(stats.itervalues())
+        skipped = stats['uptodate'] + stats['unchanged']
+        lookups = identity_map_stats['hits'] + identity_map_stats['misses']
+        _logger.debug('%s: %d imports, %d%% skipped (%d unchanged); '
+                      '%d%% of %d lookups of bindings answered by the '
+                      'identity map', self.model._name, total,
+                      100 * skipped / total, stats['unchanged'],
+                      100 * identity_map_stats['hits'] / (lookups or 1),
+                      lookups)
 
     def _import_dependency(self, shopware_id, binding_model,
                            importer_class=None, always=False):
@@ -116,7 +277,57 @@ class ShopwareImporter(Importer):
         binder = self.binder_for(binding_model)
         if always or binder.to_openerp(shopware_id) is None:
             importer = self.unit_for(importer_class, model=binding_model)
-            importer.run(shopware_id)
+            importer.run(shopware_id,
+                         record=self._prefetched_record(binding_model,
+                                                        shopware_id))
+
+    def _import_dependency_many(self, shopware_ids, binding_model,
+                                importer_class=None, always=False):
+        """ Import several dependencies of the same model.
+
+        Same as :meth:`_import_dependency`, but the bindings of all the
+        records are searched at once.
+
+        :param shopware_ids: ids of the related bindings to import
+        :param binding_model: name of the binding model for the relation
+        :type binding_model: str | unicode
+        :param importer_cls: class or parent class to use for the import.
+                             By default: ShopwareImporter
+        :param always: if True, the records are updated even if they
+                       already exist
+        :type always: boolean
+        """
+        shopware_ids = [shopware_id for shopware_id
+                        in OrderedDict.fromkeys(shopware_ids) if shopware_id]
+        if not shopware_ids:
+            return
+        if importer_class is None:
+            importer_class = ShopwareImporter
+        if not always:
+            binder = self.binder_for(binding_model)
+            existing = binder.to_openerp_many(shopware_ids)
+            shopware_ids = [shopware_id for shopware_id in shopware_ids
+                            if shopware_id not in existing]
+        for shopware_id in shopware_ids:
+            importer = self.unit_for(importer_class, model=binding_model)
+            importer.run(shopware_id,
+                         record=self._prefetched_record(binding_model,
+                                                        shopware_id))
+
+    def _prefetched_record(self, binding_model, shopware_id):
+        """ Return the record of a dependency read beforehand, if any """
+        return self._prefetched.get((binding_model, str(shopware_id)))
+
+    def _dependencies(self, record):
+        """ Return the dependencies of a Shopware record, as a list of
+        ``(binding model, shopware id, always)``
+
+        They must be the ones imported by :meth:`_import_dependencies`,
+        with the same meaning for ``always``.  An :class:`ImportPlanner`
+        uses them to import the dependencies of a batch of records
+        beforehand.
+        """
+        return []
 
     def _import_dependencies(self):
         """ Import the dependencies for the record
@@ -175,24 +386,54 @@ class ShopwareImporter(Importer):
     def _update_data(self, map_record, **kwargs):
         return map_record.values(**kwargs)
 
+    def _changed_data(self, binding, data):
+        """ Return the values of ``data`` which differ from the
+        current ones of the binding, read at once """
+        names = [name for name in data if name in binding._fields]
+        current = binding.read(names, load='_classic_write')[0]
+        return dict((name, value) for name, value in data.iteritems()
+                    if name not in current or
+                    not same_value(binding._fields[name],
+                                   current[name], value))
+
     def _update(self, binding, data):
-        """ Update an OpenERP record """
+        """ Update an OpenERP record, only the fields whose value
+        differs are written """
         # special check on data before import
         self._validate_data(data)
-        binding.with_context(connector_no_export=True).write(data)
-        _logger.debug('%d updated from shopware %s', binding, self.shopware_id)
+        changed = self._changed_data(binding, data)
+        stats = write_stats[self.model._name]
+        stats['written' if changed else 'avoided'] += 1
+        stats['fields_written'] += len(changed)
+        stats['fields_avoided'] += len(data) - len(changed)
+        _logger.debug('%s: %d writes avoided out of %d updates, %d fields '
+                      'avoided out of %d', self.model._name,
+                      stats['avoided'], stats['avoided'] + stats['written'],
+                      stats['fields_avoided'],
+                      stats['fields_avoided'] + stats['fields_written'])
+        if not changed:
+            _logger.debug('%d unchanged from shopware %s, not written',
+                          binding, self.shopware_id)
+            return
+        binding.with_context(connector_no_export=True).write(changed)
+        _logger.debug('%d updated from shopware %s: %s', binding,
+                      self.shopware_id, ', '.join(sorted(changed)))
         return
 
     def _after_import(self, binding):
         """ Hook called at the end of the import """
         return
 
-    def run(self, shopware_id, force=False):
+    def run(self, shopware_id, force=False, record=None):
         """ Run the synchronization
 
         :param shopware_id: identifier of the record on Shopware
+        :param record: data of the record already read from Shopware
+                       with the fields of ``_read_fields``, for instance
+                       with ``read_many``; it is not read again
         """
         self.shopware_id = shopware_id
+        self._read_record = record
         lock_name = 'import({}, {}, {}, {})'.format(
             self.backend_record._name,
             self.backend_record.id,
@@ -212,8 +453,17 @@ class ShopwareImporter(Importer):
         binding = self._get_binding()
 
         if not force and self._is_uptodate(binding):
+            self._count('uptodate')
             return _('Already up-to-date.')
 
+        fingerprint = self._fingerprint()
+        if not force and self._is_unchanged(binding, fingerprint):
+            # the record is synchronized: the next batches compare
+            # their listing with the ``sync_date``
+            self.binder.bind(self.shopware_id, binding)
+            self._count('unchanged')
+            return _('Content unchanged on Shopware.')
+
         # Keep a lock on this import until the transaction is committed
         # The lock is kept since we have detected that the informations
         # will be updated into Odoo
@@ -227,12 +477,15 @@ class ShopwareImporter(Importer):
 
         if binding:
             record = self._update_data(map_record)
+            record['shopware_hash'] = fingerprint
             self._update(binding, record)
         else:
             record = self._create_data(map_record)
+            record['shopware_hash'] = fingerprint
             binding = self._create(record)
 
         self.binder.bind(self.shopware_id, binding)
+        self._count('imported')
 
         self._after_import(binding)
 
@@ -240,15 +493,161 @@ class ShopwareImporter(Importer):
 ShopwareImportSynchronizer = ShopwareImporter  # deprecated
 
 
+class ImportPlanner(ConnectorUnit):
+    """ Import the dependencies of a batch of records at once.
+
+    The records of the batch are read at once and their dependencies
+    (see :meth:`ShopwareImporter._dependencies`) are collected and
+    deduplicated, their bindings are searched with one query per model.
+    The missing ones are read at once per model, then their own
+    dependencies are collected the same way.  At the end, the
+    dependencies are imported the deepest first, so each one finds its
+    own dependencies already imported.
+
+    A dependency which fails to be read or imported is left to the
+    import of the record which needs it.
+    """
+
+    def __init__(self, connector_env):
+        super(ImportPlanner, self).__init__(connector_env)
+        # records read for the batch, by (binding model, shopware id)
+        self.prefetched = {}
+
+    def _read(self, model, shopware_ids):
+        """ Read records at once, return the ones read by id """
+        importer = self.unit_for(ShopwareImporter, model=model)
+        results = importer.backend_adapter.read_many(
+            shopware_ids, attributes=importer._read_fields())
+        records = OrderedDict()
+        for shopware_id, record, error in results:
+            if error is None:
+                records[shopware_id] = record
+                self.prefetched[(model, str(shopware_id))] = record
+        return records
+
+    def prepare(self, shopware_ids):
+        """ Read the records of the batch and import their dependencies
+
+        :return: the records read, by shopware id
+        :rtype: dict
+        """
+        records = self._read(self.model._name, shopware_ids)
+        levels = []
+        current = [(self.model._name, records)]
+        seen = set()
+        while current and len(levels) < MAX_PLAN_DEPTH:
+            wanted = OrderedDict()
+            for model, model_records in current:
+                importer = self.unit_for(ShopwareImporter, model=model)
+                for record in model_records.itervalues():
+                    for dep_model, dep_id, always in \
+                            importer._dependencies(record):
+                        if not dep_id or (dep_model, dep_id) in seen:
+                            continue
+                        seen.add((dep_model, dep_id))
+                        wanted.setdefault(dep_model, OrderedDict())
+                        wanted[dep_model][dep_id] = always
+            current = []
+            for dep_model, dep_ids in wanted.iteritems():
+                binder = self.binder_for(dep_model)
+                existing = binder.to_openerp_many(
+                    [dep_id for dep_id, always in dep_ids.iteritems()
+                     if not always])
+                missing = [dep_id for dep_id in dep_ids
+                           if dep_id not in existing]
+                if missing:
+                    current.append((dep_model,
+                                    self._read(dep_model, missing)))
+            if current:
+                levels.append(current)
+        for level in reversed(levels):
+            for model, model_records in level:
+                for shopware_id, record in model_records.iteritems():
+                    self._import_planned(model, shopware_id, record)
+        return records
+
+    def _import_planned(self, model, shopware_id, record):
+        importer = self.unit_for(ShopwareImporter, model=model)
+        importer._prefetched = self.prefetched
+        try:
+            with self.session.cr.savepoint():
+                importer.run(shopware_id, record=record)
+        except RetryableJobError:
+            # Shopware is unreachable or the rate limit is reached, the
+            # whole job is postponed
+            raise
+        except Exception as err:
+            self.env.invalidate_all()
+            clear_identity_map(self.session.cr)
+            _logger.info('import of the dependency %s %s of a batch '
+                         'failed: %s', model, shopware_id, err)
+
+
 class BatchImporter(Importer):
     """ The role of a BatchImporter is to search for a list of
     items to import, then it can either import them directly or delay
     the import of each item separately.
     """
 
+    # list the records with their ``changed`` date and import only the
+    # ones updated since the ``sync_date`` of their binding
+    _skip_uptodate = False
+
+    def __init__(self, connector_env):
+        super(BatchImporter, self).__init__(connector_env)
+        # ``changed`` dates of the records of the current page
+        self._changed = {}
+
     def run(self, filters=None):
         """ Run the synchronization """
-        record_ids = self.backend_adapter.search(filters)
+        for record_ids in self._search(filters):
+            self._import_page(record_ids)
+
+    def _search(self, filters, **kwargs):
+        if self._skip_uptodate:
+            return self._search_outdated(filters, **kwargs)
+        return self._search_ids(filters, **kwargs)
+
+    def _search_outdated(self, filters, **kwargs):
+        """ Search the records to import, skipping the ones whose
+        binding is more recent than their ``changed`` date
+
+        The records are listed with their ``changed`` date and compared
+        with the ``sync_date`` of the bindings with one query per page,
+        so nothing is read nor delayed for the up-to-date records.
+        """
+        page_size = self.backend_record.search_page_size or STREAM_PAGE_SIZE
+        pages = self.backend_adapter.search(filters, page_size=page_size,
+                                            changed=True, **kwargs)
+        for records in pages:
+            record_ids = outdated_ids(self.session, self.model._name,
+                                      self.backend_record.id, records)
+            _logger.debug('%d %s up-to-date on a page of %d, skipped',
+                          len(records) - len(record_ids), self.model._name,
+                          len(records))
+            self._changed = dict(records)
+            if record_ids:
+                yield record_ids
+
+    def _search_ids(self, filters, **kwargs):
+        """ Search the records to import.
+
+        Returns an iterator on the pages of ids, the pages are read
+        from Shopware while they are consumed, so the whole result
+        is never held in memory.  Without search page size, all the
+        ids are read in one response, decoded while it is received and
+        grouped in pages of ``STREAM_PAGE_SIZE`` ids.
+        """
+        page_size = self.backend_record.search_page_size
+        if not page_size:
+            record_ids = self.backend_adapter.search(filters, stream=True,
+                                                     **kwargs)
+            return chunked(record_ids, STREAM_PAGE_SIZE)
+        return self.backend_adapter.search(filters, page_size=page_size,
+                                           **kwargs)
+
+    def _import_page(self, record_ids):
+        """ Import or delay the import of a page of records """
         for record_id in record_ids:
             self._import_record(record_id)
 
@@ -282,8 +681,40 @@ class DelayedBatchImporter(BatchImporter):
     """ Delay import of the records """
     _model_name = None
 
+    def _import_page(self, record_ids):
+        """ Delay the import of a page of records
+
+        When an import chunk size is configured on the backend, the
+        records are grouped in jobs importing a chunk of records each.
+
+        The jobs are committed with each page so the workers can
+        start to import them while the next pages are read.
+        """
+        chunk_size = self.backend_record.import_chunk_size
+        if chunk_size:
+            for index in xrange(0, len(record_ids), chunk_size):
+                self._import_chunk(record_ids[index:index + chunk_size])
+        else:
+            super(DelayedBatchImporter, self)._import_page(record_ids)
+        self.session.commit()
+
+    def _import_chunk(self, record_ids, **kwargs):
+        """ Delay the import of a chunk of records in one job """
+        changed = dict((record_id, self._changed[record_id])
+                       for record_id in record_ids
+                       if self._changed.get(record_id))
+        if changed:
+            kwargs['changed'] = changed
+        import_record_chunk.delay(self.session,
+                                  self.model._name,
+                                  self.backend_record.id,
+                                  record_ids,
+                                  **kwargs)
+
     def _import_record(self, record_id, **kwargs):
         """ Delay the import of the records"""
+        if self._changed.get(record_id):
+            kwargs['changed'] = self._changed[record_id]
         import_record.delay(self.session,
                             self.model._name,
                             self.backend_record.id,
@@ -320,7 +751,7 @@ class TranslationImporter(Importer):
 
     def _get_shopware_data(self, shop_id=None):
         """ Return the raw Shopware data for ``self.shopware_id`` """
-        return self.backend_adapter.read(self.shopware_id, shop_id)
+        return self.backend_adapter.read(self.shopware_id, shop_id=shop_id)
 
     def run(self, shopware_id, binding_id, mapper_class=None):
         self.shopware_id = shopware_id
@@ -384,8 +815,67 @@ def import_batch(session, model_name, backend_id, filters=None):
 
 @job(default_channel='root.shopware')
 @related_action(action=link)
-def import_record(session, model_name, backend_id, shopware_id, force=False):
-    """ Import a record from Shopware """
+def import_record(session, model_name, backend_id, shopware_id, force=False,
+                  changed=None):
+    """ Import a record from Shopware
+
+    :param changed: ``changed`` date of the record when it was listed,
+                    the import is skipped without reading the record
+                    when its binding is more recent
+    """
+    if changed and not force and not outdated_ids(
+            session, model_name, backend_id, [(shopware_id, changed)]):
+        return _('Already up-to-date.')
     env = get_environment(session, model_name, backend_id)
     importer = env.get_connector_unit(ShopwareImporter)
     importer.run(shopware_id, force=force)
+
+
+@job(default_channel='root.shopware')
+def import_record_chunk(session, model_name, backend_id, shopware_ids,
+                        force=False, job_options=None, changed=None):
+    """ Import a chunk of records from Shopware
+
+    The records are read at once and their missing dependencies are
+    imported first, see :class:`ImportPlanner`.  Each record is
+    imported in its own savepoint.  When the import of a record fails,
+    it is delayed in its own ``import_record`` job (created with the
+    ``job_options``) and the chunk continues.
+
+    The records whose binding is more recent than their ``changed``
+    date, given by id when they were listed, are not read.
+    """
+    if changed and not force:
+        shopware_ids = outdated_ids(
+            session, model_name, backend_id,
+            [(shopware_id, changed.get(shopware_id))
+             for shopware_id in shopware_ids])
+    env = get_environment(session, model_name, backend_id)
+    planner = ImportPlanner(env)
+    records = planner.prepare(shopware_ids)
+    failed = []
+    for shopware_id in shopware_ids:
+        importer = env.get_connector_unit(ShopwareImporter)
+        importer._prefetched = planner.prefetched
+        try:
+            with session.cr.savepoint():
+                importer.run(shopware_id, force=force,
+                             record=records.get(shopware_id))
+        except RetryableJobError:
+            # Shopware is unreachable or the rate limit is reached: the
+            # whole chunk is postponed rather than split in jobs
+            raise
+        except Exception as err:
+            session.env.invalidate_all()
+            clear_identity_map(session.cr)
+            _logger.info('import of %s %s failed in a chunk, delayed in '
+                         'its own job: %s', model_name, shopware_id, err)
+            failed.append(shopware_id)
+            import_record.delay(session, model_name, backend_id,
+                                shopware_id, force=force,
+                                **(job_options or {}))
+    if failed:
+        return _('%d records imported, %d failed and are delayed in '
+                 'their own job: %s') % (len(shopware_ids) - len(failed),
+                                         len(failed), failed)
+    return _('%d records imported.') % len(shopware_ids)
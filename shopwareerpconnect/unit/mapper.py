@@ -29,3 +29,21 @@ def normalize_datetime(field):
             return None
         return record[field]
     return modifier
+
+
+def source_fields(mapper):
+    """ Return the keys of the Shopware record used by an import mapper
+
+    The mappers declare the keys read by their ``@mapping`` methods in
+    ``_source_fields``, the sources of the ``direct`` mappings are added
+    to them.  Return None when the mapper does not declare them: it
+    needs the full record.
+    """
+    declared = getattr(mapper, '_source_fields', None)
+    if declared is None:
+        return None
+    fields = set(declared)
+    for source, __ in getattr(mapper, 'direct', []):
+        if isinstance(source, basestring):
+            fields.add(source)
+    return fields